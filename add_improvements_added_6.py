@@ -7,15 +7,15 @@
 #- **Command Injection Protection:** Currently, the script executes commands directly from the model's output. This can be risky. Sanitize commands to avoid potentially dangerous inputs (like `rm -rf /`). This is especially important if the assistant will ever be exposed to untrusted users.
 #
 #  ```python
-def sanitize_command(command, allowed_patterns=None):
-    if allowed_patterns is None:
-        allowed_patterns = [
-            r'^ls ', r'^cat ', r'^echo ', r'^grep ', r'^find ', r'^mkdir ', r'^cp ', r'^mv ', r'^rm '
-        ]
-    if any(re.match(pattern, command) for pattern in allowed_patterns):
-        return command
-    else:
-        raise ValueError(f"Command '{command}' is not allowed for security reasons.")
+from assistant_policy import CONFIRM, DENY, load_policy
+
+command_policy = load_policy()  # compiled allow/confirm/deny rules from command_policy.json
+
+def sanitize_command(command):
+    verdict = command_policy.check(command)
+    if verdict.action == DENY:
+        raise ValueError(f"Command '{command}' is not allowed for security reasons: {verdict.reason}")
+    return command
   #```
 
 ### 2. Enhanced User Interaction
@@ -24,7 +24,7 @@ def sanitize_command(command, allowed_patterns=None):
 #
 #  ```python
 def potentially_destructive(command):
-    return any(cmd in command for cmd in ['rm ', 'mv ', 'cp ', 'chmod ', '>'])
+    return command_policy.check(command).action == CONFIRM
 
 if potentially_destructive(command):
     confirm = input(f"Are you sure you want to execute '{command}'? (yes/no): ")
@@ -124,6 +124,10 @@ import logging
 
 from groq import Groq
 
+from assistant_policy import CONFIRM, DENY, load_policy
+
+command_policy = load_policy()
+
 # Initialize logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -181,12 +185,13 @@ Please provide the most appropriate command for the user's request, considering
 """
 
 def sanitize_command(command):
-    if potentially_destructive(command):
-        raise ValueError(f"Potentially destructive command detected: {command}")
+    verdict = command_policy.check(command)
+    if verdict.action == DENY:
+        raise ValueError(f"Command refused by the command policy: {verdict.reason}")
     return command
 
 def potentially_destructive(command):
-    return any(cmd in command for cmd in ['rm ', 'mv ', 'cp ', 'chmod ', '>'])
+    return command_policy.check(command).action == CONFIRM
 
 def main():
     shell_type = detect_shell()
@@ -93,18 +93,13 @@
 
 #```python
 import os
-import shlex
-from pathlib import Path
 from dotenv import load_dotenv
-import subprocess
 import traceback
 import json
-from groq import Groq
 import platform
 import logging
 
-# Setup logging
-logging.basicConfig(filename='assistant.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging is set up by setup_logging() in main()
 
 # Initialize an empty list to keep the history of commands and their contexts
 command_history = []
@@ -176,28 +171,70 @@ Please be concise and only provide the necessary command, without any additional
 #In the full script, I've included the modified system prompt and ensured the assistant provides concise commands using logical operators:
 
 
+import argparse
 import os
-import shlex
-from pathlib import Path
 from dotenv import load_dotenv
-import subprocess
 import traceback
 import json
-from groq import Groq
 import platform
 import logging
-
-# Setup logging
-logging.basicConfig(filename='assistant.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Initialize an empty list to keep the history of commands and their contexts
-command_history = []
+import sys
+import threading
+import time
+
+from assistant_batch import BATCH_EXEC_WORKERS, BATCH_LLM_WORKERS, read_queries, run_batch
+from assistant_backends import LLM_BACKEND, OPENAI_BASE_URL, backend_class
+from assistant_client import ClientManager
+from assistant_cache import RESPONSE_CACHE_ENABLED, ResponseCache, cache_key
+from assistant_exec import (STREAM_OUTPUT, CommandDetached, RunningCommand, execute_command_captured,
+                            execute_command_streaming, format_output_stats)
+from assistant_history import CommandHistory, HistoryRecord, HistoryStore
+from assistant_jobs import JOB_DETACH_SECONDS, JobTable, split_background
+from assistant_models import ModelRouter
+from assistant_llm import (COMMAND_CANDIDATES, STREAM_COMPLETIONS, Alternatives, CandidateStats, parse_alternatives,
+                           stream_candidates, stream_command)
+from assistant_limits import load_limits
+from assistant_logging import field_preview, setup_logging
+from assistant_path import check_program_installed
+from assistant_policy import ALLOW, COMMAND_POLICY, CONFIRM, load_policy
+from assistant_prompt import (RETRY_ERROR_TOKENS, answer_max_tokens, build_system_prompt, estimate_tokens,
+                              truncate_to_tokens)
+from assistant_retrieval import RETRIEVAL_ENABLED, RetrievalIndex
+from assistant_router import load_router
+from assistant_scheduler import BACKGROUND, INTERACTIVE, RequestScheduler
+from assistant_search import TrigramIndex
+from assistant_shell import PERSISTENT_SHELL, ShellSession
+from assistant_tracing import tracer
+
+# Logging is set up in main(): records are queued and written by a background thread
+log_listener = None
+
+# Keep a bounded window of recent commands and their contexts
 COMMAND_HISTORY_LENGTH = 10
-HISTORY_FILE = "command_history.json"
+command_history = CommandHistory(maxlen=COMMAND_HISTORY_LENGTH)
+HISTORY_FILE = "command_history.json"  # legacy format, imported into the history store once
 
 GROQ_MODEL = os.getenv("GROQ_MODEL", "mixtral-8x7b-32768")
 GROQ_TEMPERATURE = float(os.getenv("GROQ_TEMPERATURE", 0.1))
 
+client_manager = None
+client = None
+response_cache = None
+history_store = None
+history_index = TrigramIndex()
+retrieval_index = RetrievalIndex() if RETRIEVAL_ENABLED else None
+intent_router = None
+limit_policy = None  # timeouts and rlimits per command class, loaded in main()
+command_policy = None  # allow/confirm/deny rules, loaded in main()
+job_table = None  # background jobs of the interactive session
+shell_session = None  # the interactive session's persistent shell
+candidate_stats = CandidateStats()
+request_scheduler = RequestScheduler()  # every completion call goes through here
+model_router = ModelRouter(GROQ_MODEL)
+
+class LocalAnswer(Exception):
+    """A local intent matched but answers with a message rather than a command."""
+
 def detect_shell_and_os():
     """Detect the current shell and operating system."""
     shell = os.getenv('SHELL', '/bin/bash')
@@ -205,19 +242,75 @@ def detect_shell_and_os():
     operating_system = platform.system().lower()
     return shell_name, operating_system
 
-def execute_command(command):
-    """Execute a shell command and return the output and exit code."""
-    try:
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        stdout, stderr = process.communicate()
-        exit_code = process.wait()
-        return stdout.decode().strip(), stderr.decode().strip(), exit_code
-    except Exception as e:
-        return "", str(e), 1
-
-def check_program_installed(program: str) -> bool:
-    """Check if a particular program is installed and available."""
-    return subprocess.call(['which', program], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+def authorize_command(command, interactive=True):
+    """
+    Check a command against the command policy, asking the user if it needs
+    confirmation. Returns (allowed, message): the message says why it may not
+    run, or is None when the user declined it.
+    """
+    if command_policy is None:
+        return True, None
+    with tracer.span("sanitize", command=command) as span:
+        verdict = command_policy.check(command)
+        span.set(verdict=verdict.action, rule=verdict.rule)
+    if verdict.action == ALLOW:
+        return True, None
+    logging.info(f"Command policy: {verdict.action} [{command}]: {verdict.reason}")
+    if verdict.action == CONFIRM:
+        if not interactive:
+            return False, f"Not run, needs confirmation: {verdict.reason}"
+        answer = input(f"This command {verdict.reason}. Run it? (y/N): ").strip().lower()
+        if answer in ("y", "yes"):
+            return True, None
+        print("Command execution canceled by user.")
+        return False, None
+    return False, f"Refused by the command policy: {verdict.reason}"
+
+def execute_command(command, limits=None, job_context=None):
+    """
+    Execute a shell command under its limits (by default those of its command
+    class) and return the output and exit code.
+
+    With job_context=(user_prompt, key, source), a command still running after
+    JOB_DETACH_SECONDS becomes a background job, which records its own outcome;
+    (None, None, None) is returned then, as when the user declined to run it or
+    interrupted it with Ctrl-C: a cancellation, not a failure to retry.
+    A command the policy refuses fails with the reason as its error.
+    """
+    allowed, message = authorize_command(command)
+    if not allowed:
+        return (None, None, None) if message is None else ("", message, 1)
+    if limits is None and limit_policy is not None:
+        limits = limit_policy.resolve(command)
+    with tracer.span("exec", command=command, limits=limits.label if limits is not None else None) as span:
+        if STREAM_OUTPUT:
+            detach_after = JOB_DETACH_SECONDS if job_context is not None and job_table is not None else 0
+            # rlimits apply to a whole process, so such commands cannot run in the session shell
+            session = shell_session if limits is None or not limits.rlimits() else None
+            # Output is shown while it runs; only head and tail are kept in memory
+            try:
+                stdout, stderr, exit_code, stats = execute_command_streaming(command, limits=limits,
+                                                                             detach_after=detach_after or None,
+                                                                             session=session)
+            except CommandDetached as e:
+                user_prompt, key, source = job_context
+                job = job_table.add(e.run, user_prompt, (key, source), started=lambda job: print(
+                    f"\n[{job.id}] Still running after {detach_after:g}s, moved to the background. "
+                    f"Use 'fg {job.id}' to follow it or 'cancel {job.id}' to stop it."))
+                span.set(job=job.id)
+                return None, None, None
+            print(format_output_stats(stats, limits))
+            logging.info(f"Command: {command}, Output stats: {stats}")
+        else:
+            stdout, stderr, exit_code, stats = execute_command_captured(command, limits)
+        if stats['killed']:
+            logging.warning(f"Command killed ({stats['killed']}): {command}, limits: {limits}")
+        span.set(exit_code=exit_code, stdout_bytes=stats['stdout_bytes'], stderr_bytes=stats['stderr_bytes'],
+                 killed=stats['killed'], spawn=stats.get('spawn'), cpu_seconds=stats.get('cpu_seconds'))
+        if stats['killed'] == "interrupted":
+            print("Command interrupted.")
+            return None, None, None
+        return stdout, stderr, exit_code
 
 def provide_helpful_tips(command: str, stderr: str) -> str:
     """Provide tips or suggestions when a command fails."""
@@ -225,108 +318,486 @@ def provide_helpful_tips(command: str, stderr: str) -> str:
         return f"Tip: The directory in the command '{command}' does not exist. Please check the path."
     if "command not found" in stderr:
         program = command.split()[0]
+        for alternative in (f"{program}3", program.rstrip("3")):
+            if alternative != program and check_program_installed(alternative):
+                return f"Tip: The command '{program}' is not available, but '{alternative}' is. Try using that instead."
         return f"Tip: The command '{program}' is not available. Please install it or check your spelling."
     return stderr
 
 def update_command_history(user_prompt, command, success, output=None, error=None):
-    command_history.append({
-        'user_prompt': user_prompt,
-        'command': command,
-        'success': success,
-        'output': output,
-        'error': error
-    })
-    # Keep only the last N commands in memory to avoid unbounded growth
-    if len(command_history) > COMMAND_HISTORY_LENGTH:
-        command_history.pop(0)
-
-    log_command(user_prompt, command, success, output, error)
-
-def log_command(user_prompt, command, success, output=None, error=None):
-    """Log command execution results."""
+    # The full output goes to the store; memory only keeps a preview and a reference to it
+    history_id = history_store.append(user_prompt, command, success, output, error) if history_store is not None else None
+    command_history.append(HistoryRecord(user_prompt, command, success, output, error, history_id))
+    history_index.add(user_prompt, command, success)
+    if retrieval_index is not None:
+        retrieval_index.add(user_prompt, command, success)
+
+    log_command(user_prompt, command, success, output, error, history_id)
+
+def start_job(user_prompt, command, limits, key, source):
+    """Run a command as a background job right away; returns None if the policy or the user stops it."""
+    allowed, message = authorize_command(command)
+    if not allowed:
+        if message is not None:
+            print(message)
+            update_command_history(user_prompt, command, False, error=message)
+        return None
+    if limits is None and limit_policy is not None:
+        limits = limit_policy.resolve(command)
+    return job_table.add(RunningCommand(command, limits, echo=False), user_prompt, (key, source),
+                         started=lambda job: print(f"[{job.id}] Running [{command}] in the background."))
+
+def finish_job(job):
+    """Record a finished background job like a foreground command."""
+    stdout, stderr, exit_code, stats = job.result
+    key, source = job.context
+    with tracer.span("job", command=job.command, job=job.id) as span:
+        span.set(exit_code=exit_code, stdout_bytes=stats['stdout_bytes'], stderr_bytes=stats['stderr_bytes'],
+                 killed=stats['killed'], runtime_seconds=round(job.runtime, 3))
+        record_outcome(key, job.user_prompt, job.command, exit_code == 0, source)
+        if exit_code == 0:
+            update_command_history(job.user_prompt, job.command, True, stdout)
+        else:
+            update_command_history(job.user_prompt, job.command, False, error=provide_helpful_tips(job.command, stderr))
+
+def run_job_command(action, job_id):
+    """Handle the 'jobs', 'fg [N]' and 'cancel [N]' REPL commands."""
+    if action == "jobs":
+        jobs = job_table.jobs()
+        print("\n".join(job.describe() for job in jobs) if jobs else "No jobs.")
+        return
+    job = job_table.get(int(job_id) if job_id else None)
+    if job is None:
+        print(f"No such job: {job_id}" if job_id else "No jobs.")
+    elif action == "fg":
+        job_table.follow(job)
+    elif not job_table.cancel(job):
+        print(f"[{job.id}] Already finished: {job.state}")
+
+def load_command_history():
+    """Open the history store and load only the tail needed for the system prompt."""
+    global history_store
+    history_store = HistoryStore()
+    imported = history_store.import_json(HISTORY_FILE)
+    if imported:
+        logging.info(f"Imported {imported} entries from {HISTORY_FILE} into {history_store.path}")
+    command_history.clear()
+    command_history.extend(HistoryRecord.from_entry(entry) for entry in history_store.tail(COMMAND_HISTORY_LENGTH))
+    # Index the full history for suggestions without delaying the first prompt
+    threading.Thread(target=history_index.refresh, args=(history_store,), daemon=True).start()
+    if retrieval_index is not None:
+        threading.Thread(target=retrieval_index.refresh, args=(history_store,), daemon=True).start()
+
+def log_command(user_prompt, command, success, output=None, error=None, history_id=None):
+    """
+    Log command execution results. Output and error are cut to a preview; the
+    full text stays in the history store under history_id.
+    """
     result = "Success" if success else "Error"
-    logging.info(f"User Prompt: {user_prompt}, Command: {command}, Result: {result}, Output: {output}, Error: {error}")
-
-def generate_system_prompt(shell_name, operating_system):
-    """Generate the system prompt, incorporating command history and environment information."""
-    platform_info = {
-        "macos": {
-            "open_command": "open",
-            "browser": "Safari"
-        },
-        "linux": {
-            "open_command": "xdg-open",
-            "browser": "firefox"
-        },
-        "windows": {
-            "open_command": "start",
-            "browser": "Microsoft Edge"
-        }
-    }
-
-    platform_data = platform_info.get(operating_system, {})
-    history_info = '\n'.join([
-        f"Previous Command: {h['command']}, Success: {h['success']}, Error: {h['error'] or 'None'}"
-        for h in command_history[-3:]
-    ])  # Last 3 commands
-
-    system_prompt = f"""You are an AI assistant that understands natural language prompts and generates the most appropriate shell commands to execute based on the user's request. Your task is to analyze the user's input and determine the best command to execute, then provide the command in a valid JSON format with a "command" key.
-
-Environment Information:
-- Shell: {shell_name}
-- Operating System: {operating_system}
-- Open Command: {platform_data.get("open_command", "unknown")}
-- Default Browser: {platform_data.get("browser", "unknown")}
-
-{history_info}
-
-When the user asks for a complex task, respond with a single command line using pipes (`|`), logical operators (`&&`, `||`), and redirections (`>`, `>>`, `<`). Your goal is to provide the most appropriate command for the user's request.
-
-For example:
-- If the user says "Install and start Apache," respond with:
-  {"command": "sudo apt update && sudo apt install -y apache2 && sudo systemctl start apache2"}
-- If the user says "Partition and format USB," respond with:
-  {"command": "usb=/dev/sdX && sudo fdisk $usb <<< $(printf 'n\np\n\n\n\nw') && sudo mkfs.ext4 ${usb}1"} # type: ignore
-
-Please be concise and only provide the necessary command, without any additional explanation or context. Your goal is to provide the most appropriate command for the user's request.
-"""
-    return system_prompt
-
-def handle_error_and_retry(user_prompt, error_message, shell_name, operating_system):
-    """Handle errors by requesting a new command based on the error message."""
-    retry_prompt = f"The last command failed with the following error: {error_message}. Please modify the command to fix the error."
-    system_prompt = generate_system_prompt(shell_name, operating_system)
-    chat_completion = client.chat.completions.create( # type: ignore
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": retry_prompt}
-        ],
-        model=GROQ_MODEL,
-        temperature=GROQ_TEMPERATURE,
-        max_tokens=32768,
-        response_format={"type": "json_object"}
-    )
-
+    logging.info(f"User Prompt: {user_prompt}, Command: {command}, Result: {result}", extra={'fields': {
+        'event': "command",
+        'prompt': field_preview(user_prompt),
+        'command': field_preview(command),
+        'success': bool(success),
+        'output_bytes': len(output) if output else 0,
+        'output_preview': field_preview(output),
+        'error': field_preview(error),
+        'history_id': history_id,
+    }})
+
+def generate_system_prompt(shell_name, operating_system, user_prompt=None):
+    """
+    Generate the system prompt: the session-static prefix followed by recent command
+    history and, when the prompt is known, similar requests that worked before.
+    """
+    examples = retrieval_index.search(user_prompt) if retrieval_index is not None and user_prompt else ()
+    return build_system_prompt(shell_name, operating_system, command_history.recent(3), examples)  # Last 3 commands
+
+def log_request_usage(model, prompt_tokens, completion_tokens, max_tokens, latency, estimated=False):
+    """Log request size next to latency so the two can be correlated."""
+    approx = "~" if estimated else ""
+    logging.info(f"LLM request: model={model}, prompt_tokens={approx}{prompt_tokens}, "
+                 f"completion_tokens={approx}{completion_tokens}, max_tokens={max_tokens}, latency={latency:.3f}s")
+    tracer.annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, max_tokens=max_tokens,
+                    tokens_estimated=estimated, time_to_command=round(latency, 6))
+
+def notify_rate_limit(seconds):
+    print(f"Rate limit reached, waiting {seconds:.1f}s ...")
+
+def request_command(system_prompt, user_prompt, priority=INTERACTIVE, model=GROQ_MODEL):
+    """
+    Ask the model for a command; return it with the time it took to arrive and
+    its ranked fallback Alternatives (empty unless COMMAND_CANDIDATES > 1).
+
+    The call is queued by the request scheduler at the given priority and
+    retried there on rate limits and transient errors.
+    """
+    with tracer.span("llm.request", model=model, priority="interactive" if priority == INTERACTIVE else "background"):
+        return _request_command(system_prompt, user_prompt, priority, model)
+
+def _request_command(system_prompt, user_prompt, priority, model):
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    max_tokens = answer_max_tokens(command_history.recent(3))
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+    notify = notify_rate_limit if priority == INTERACTIVE else None
+    if STREAM_COMPLETIONS:
+        # The command is returned as soon as it is complete, so usage is estimated
+        if COMMAND_CANDIDATES > 1:
+            command, time_to_command, response_text, alternatives = request_scheduler.submit(
+                lambda: stream_candidates(client, messages, model, GROQ_TEMPERATURE, max_tokens),
+                prompt_tokens + max_tokens, priority, notify)
+        else:
+            command, time_to_command, response_text = request_scheduler.submit(
+                lambda: stream_command(client, messages, model, GROQ_TEMPERATURE, max_tokens),
+                prompt_tokens + max_tokens, priority, notify)
+            alternatives = Alternatives()
+            request_scheduler.refund(max_tokens - estimate_tokens(response_text))
+        log_request_usage(model, prompt_tokens, estimate_tokens(response_text), max_tokens, time_to_command, estimated=True)
+        return command, time_to_command, alternatives
+
+    def create():
+        start = time.perf_counter()
+        chat_completion = client.chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=GROQ_TEMPERATURE,
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"}
+        )
+        return chat_completion, time.perf_counter() - start
+
+    chat_completion, latency = request_scheduler.submit(create, prompt_tokens + max_tokens, priority, notify)
+    usage = chat_completion.usage
+    request_scheduler.refund(prompt_tokens + max_tokens - usage.prompt_tokens - usage.completion_tokens)
+    log_request_usage(model, usage.prompt_tokens, usage.completion_tokens, max_tokens, latency)
     response_json = chat_completion.choices[0].message.content
-    try:
-        command_dict = json.loads(response_json)
-        command = command_dict['command']
-        print(f"Retrying command [{command}] ...")
+    command = json.loads(response_json)['command']
+    return command, latency, Alternatives(parse_alternatives(response_json, command))
+
+def print_latency(time_to_command, turn_start):
+    """Show how long the command took to arrive next to the total turn latency."""
+    print(f"[time to command: {time_to_command:.2f}s, total: {time.perf_counter() - turn_start:.2f}s]")
+
+def suggest_similar_commands(user_prompt):
+    """Suggest commands from past prompts that look like this one."""
+    if history_store is not None:
+        history_index.refresh(history_store)
+        if retrieval_index is not None:
+            retrieval_index.refresh(history_store)
+    suggestions = history_index.search(user_prompt)
+    if suggestions:
+        print("Did you mean one of these commands?")
+        for i, (score, prompt, command, success) in enumerate(suggestions, 1):
+            print(f"{i}. {command}  (from \"{prompt}\"{'' if success else ', failed'})")
+
+def lookup_command(user_prompt, shell_name, operating_system, priority=INTERACTIVE):
+    """
+    Return (command, time_to_command, key, source, alternatives, limits) for a prompt.
+
+    source is "intent" for a local intent match, "cache" for a cache hit and
+    "llm" otherwise; the first two skip the system prompt and the network and
+    come without alternatives. limits is set when the intent overrides the
+    command limits, else None for those of the command class.
+    Raises LocalAnswer when a local intent answers with a message instead.
+    """
+    start = time.perf_counter()
+    if intent_router is not None:
+        match = intent_router.match(user_prompt)
+        if match is not None:
+            if match.message:
+                raise LocalAnswer(match.message)
+            command = match.command
+            limits = limit_policy.resolve(command, match.intent.limits) if match.intent.limits else None
+            return command, time.perf_counter() - start, None, "intent", Alternatives(), limits
+    # Keyed on the routed model, so the fast and the large model's answers are cached apart
+    model, reason = model_router.choose(user_prompt)
+    key = cache_key(user_prompt, shell_name, operating_system, model, GROQ_TEMPERATURE)
+    if response_cache is not None:
+        command = response_cache.get(key)
+        if command is not None:
+            return command, time.perf_counter() - start, key, "cache", Alternatives(), None
+    system_prompt = generate_system_prompt(shell_name, operating_system, user_prompt)
+    command, time_to_command, alternatives = request_command(system_prompt, user_prompt, priority, model)
+    model_router.record_latency(model, reason, time_to_command)
+    return command, time_to_command, key, "llm", alternatives, None
+
+def record_outcome(key, user_prompt, command, success, source):
+    """
+    Credit the model that wrote an LLM command with its outcome, cache LLM
+    commands that worked and drop cached ones that no longer do.
+    """
+    if source == "llm":
+        model_router.record_outcome(user_prompt, success)
+    if response_cache is None:
+        return
+    if success and source == "llm":
+        response_cache.put(key, user_prompt, command)
+    elif not success and source == "cache":
+        response_cache.invalidate(key)
+
+def try_alternatives(user_prompt, alternatives, key, error_message):
+    """
+    Run the fallback candidates of a failed command in order until one works.
+    Return None if one did, else the latest error for the LLM retry.
+    """
+    with tracer.span("alternatives") as span:
+        error_message = _run_alternatives(user_prompt, alternatives, key, error_message, span)
+    return error_message
+
+def _run_alternatives(user_prompt, alternatives, key, error_message, span):
+    tried = 0
+    for command in alternatives.get():
+        tried += 1
+        span.set(tried=tried)
+        print(f"Trying alternative [{command}] ...")
         stdout, stderr, exit_code = execute_command(command)
-
+        if exit_code is None:
+            return None  # the user declined it; stop here rather than ask the model again
         if exit_code == 0:
             update_command_history(user_prompt, command, True, stdout)
+            record_outcome(key, user_prompt, command, True, "llm")
+            candidate_stats.record(tried, saved=True)
             print("Command executed successfully.")
-            print("Command output:")
-            print(stdout)
+            if not STREAM_OUTPUT:
+                print("Command output:")
+                print(stdout)
+            return None
+        error_message = provide_helpful_tips(command, stderr)
+        update_command_history(user_prompt, command, False, error=error_message)
+        print("Error executing command:")
+        print(error_message)
+    candidate_stats.record(tried, saved=False)
+    return error_message
+
+def handle_error_and_retry(user_prompt, error_message, shell_name, operating_system):
+    """Handle errors by requesting a new command based on the error message."""
+    error_message = truncate_to_tokens(error_message, RETRY_ERROR_TOKENS)
+    retry_prompt = f"The last command failed with the following error: {error_message}. Please modify the command to fix the error."
+    system_prompt = generate_system_prompt(shell_name, operating_system, user_prompt)
+    with tracer.span("retry") as span:
+        turn_start = time.perf_counter()
+        try:
+            model, reason = model_router.choose(user_prompt, escalate=True)
+            command, time_to_command, _ = request_command(system_prompt, retry_prompt, model=model)
+            model_router.record_latency(model, reason, time_to_command)
+            span.set(command=command)
+            print(f"Retrying command [{command}] ...")
+            stdout, stderr, exit_code = execute_command(command, job_context=(user_prompt, None, "retry"))
+            print_latency(time_to_command, turn_start)
+            if exit_code is None:
+                return  # became a background job, or the user declined or interrupted it
+            model_router.record_outcome(user_prompt, exit_code == 0)
+
+            if exit_code == 0:
+                update_command_history(user_prompt, command, True, stdout)
+                print("Command executed successfully.")
+                if not STREAM_OUTPUT:
+                    print("Command output:")
+                    print(stdout)
+            else:
+                helpful_tips = provide_helpful_tips(command, stderr)
+                update_command_history(user_prompt, command, False, error=helpful_tips)
+                print("Error executing command:")
+                print(helpful_tips)
+        except json.JSONDecodeError as e:
+            span.fail(e)
+            print(f"Error parsing response as JSON: {e}")
+            print(f"Response JSON: {e.doc}")
+            print("Tip: Please ensure your input is clear, or try simplifying your request.")
+        except Exception as e:
+            span.fail(e)
+            print(f"Error: {e}")
+            traceback.print_exc()
+            print("Tip: An unexpected error occurred. Please try again.")
+
+def create_client():
+    """Load credentials from the environment and build the pooled client manager for LLM_BACKEND."""
+    load_dotenv()
+    if LLM_BACKEND != "groq":
+        # Local OpenAI-compatible servers and the offline fake need no Groq key
+        return ClientManager(os.getenv("OPENAI_API_KEY", ""), OPENAI_BASE_URL, backend_class(LLM_BACKEND))
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("GROQ_API_KEY not found in environment variables.")
+    return ClientManager(api_key)
+
+def run_batch_file(queries_path, output_path, shell_name, operating_system, llm_workers, exec_workers):
+    """Run every query in a file non-interactively and write ordered JSONL results."""
+    queries = read_queries(queries_path)
+    cache_outcomes = {}
+    intent_limits = {}
+
+    def command_for(query):
+        command, _, key, source, _, limits = lookup_command(query, shell_name, operating_system, BACKGROUND)
+        cache_outcomes[query] = (key, source)
+        if limits is not None:
+            intent_limits[command] = limits
+        return command
+
+    def run(command):
+        allowed, message = authorize_command(command, interactive=False)
+        if not allowed:
+            return "", message, 1
+        limits = intent_limits.get(command) or limit_policy.resolve(command)
+        stdout, stderr, exit_code, _ = execute_command_streaming(command, echo=False, limits=limits)
+        return stdout, stderr, exit_code
+
+    output = open(output_path, "w") if output_path != "-" else sys.stdout
+    try:
+        for result in run_batch(queries, command_for, run, llm_workers, exec_workers):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            if result['command']:
+                success = result['exit_code'] == 0
+                key, source = cache_outcomes[result['query']]
+                record_outcome(key, result['query'], result['command'], success, source)
+                update_command_history(result['query'], result['command'], success,
+                                       result['stdout'] if success else None,
+                                       None if success else result['error'] or result['stderr'])
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logging.info(f"Batch run of {len(queries)} queries from {queries_path} written to {output_path}")
+
+def run_interactive(shell_name, operating_system):
+    """Read queries from the prompt until the user exits."""
+    while True:
+        user_prompt = input("Query:> ")
+
+        # Exit check
+        if user_prompt.lower().strip() in ['exit', 'quit']:
+            break
+        if user_prompt.lower().strip() == 'cache stats':
+            print(response_cache.stats() if response_cache is not None else "Response cache is disabled.")
+            continue
+        if user_prompt.lower().strip() == 'model stats':
+            print(model_router.stats())
+            continue
+        if user_prompt.lower().strip() == 'candidate stats':
+            print(candidate_stats.stats() if COMMAND_CANDIDATES > 1 else "Multi-candidate generation is disabled.")
+            continue
+        words = user_prompt.lower().split()
+        if words and words[0] in ('jobs', 'fg', 'cancel') and (
+                len(words) == 1 or (len(words) == 2 and words[0] != 'jobs' and words[1].lstrip('%').isdigit())):
+            run_job_command(words[0], words[1].lstrip('%') if len(words) == 2 else None)
+            continue
+        user_prompt, background = split_background(user_prompt)
+
+        # Suggest similar commands
+        suggest_similar_commands(user_prompt)
+
+        turn_start = time.perf_counter()
+
+        with tracer.span("query", prompt=user_prompt) as span:
+            try:
+                command, time_to_command, key, source, alternatives, limits = lookup_command(
+                    user_prompt, shell_name, operating_system)
+                span.set(source=source, command=command)
+                command, command_background = split_background(command)
+                if background or command_background:
+                    span.set(background=True)
+                    start_job(user_prompt, command, limits, key, source)
+                    continue
+                print(f"Running command [{command}] ..." + ("" if source == "llm" else f" ({source})"))
+                stdout, stderr, exit_code = execute_command(command, limits, (user_prompt, key, source))
+                print_latency(time_to_command, turn_start)
+                if exit_code is None:
+                    continue  # became a background job, or the user declined or interrupted it
+                record_outcome(key, user_prompt, command, exit_code == 0, source)
+
+                if exit_code == 0:
+                    update_command_history(user_prompt, command, True, stdout)
+                    print("Command executed successfully.")
+                    if not STREAM_OUTPUT:
+                        print("Command output:")
+                        print(stdout)
+                else:
+                    helpful_tips = provide_helpful_tips(command, stderr)
+                    update_command_history(user_prompt, command, False, error=helpful_tips)
+                    print("Error executing command:")
+                    print(helpful_tips)
+                    if COMMAND_CANDIDATES > 1 and source == "llm":
+                        # Only go back to the model once every candidate from the first answer failed
+                        helpful_tips = try_alternatives(user_prompt, alternatives, key, helpful_tips)
+                    if helpful_tips is not None:
+                        handle_error_and_retry(user_prompt, helpful_tips, shell_name, operating_system)
+            except LocalAnswer as e:
+                span.set(source="intent", message=str(e))
+                print(e)
+            except json.JSONDecodeError as e:
+                span.fail(e)
+                print(f"Error parsing response as JSON: {e}")
+                print(f"Response JSON: {e.doc}")
+                print("Tip: Please ensure your input is clear, or try simplifying your request.")
+            except Exception as e:
+                span.fail(e)
+                print(f"Error: {e}")
+                traceback.print_exc()
+                print("Tip: An unexpected error occurred. Please try again.")
+
+def main():
+    global client_manager, client, response_cache, intent_router, limit_policy, command_policy, job_table, shell_session
+    global log_listener
+    parser = argparse.ArgumentParser(description="Translate natural language queries into shell commands.")
+    parser.add_argument("--batch", metavar="QUERIES_FILE", help="run the queries in this file non-interactively")
+    parser.add_argument("--output", default="-", help="JSONL results file for --batch (default: stdout)")
+    parser.add_argument("--llm-workers", type=int, default=BATCH_LLM_WORKERS, help="concurrent LLM requests in batch mode")
+    parser.add_argument("--exec-workers", type=int, default=BATCH_EXEC_WORKERS, help="concurrent commands in batch mode")
+    args = parser.parse_args()
+
+    log_listener = setup_logging()
+    try:
+        client_manager = create_client()
+        client = client_manager.client
+        # Open the connection while history loads and the user types the first prompt
+        client_manager.prewarm()
+        if RESPONSE_CACHE_ENABLED:
+            response_cache = ResponseCache()
+        intent_router = load_router()
+        limit_policy = load_limits()
+        if COMMAND_POLICY:
+            command_policy = load_policy()
+        load_command_history()
+        shell_name, operating_system = detect_shell_and_os()
+
+        if args.batch:
+            run_batch_file(args.batch, args.output, shell_name, operating_system, args.llm_workers, args.exec_workers)
         else:
-            helpful_tips = provide_helpful_tips(command, stderr)
-            update_command_history(user_prompt, command, False, error=helpful_tips)
-            print("Error executing command:")
-            print(helpful_tips)
-    except json.JSONDecodeError as e:
-        print(f"Error parsing response as JSON: {e}")
-        print(f"Response JSON: {response_json}")
-        print("Tip: Please ensure your input is clear, or try simplifying your request.")
+            job_table = JobTable(on_finish=finish_job)
+            if PERSISTENT_SHELL and STREAM_OUTPUT:
+                shell_session = ShellSession()
+                shell_session.prewarm()
+                # Commands are written for the shell that runs them
+                shell_name = os.path.basename(shell_session.path)
+            run_interactive(shell_name, operating_system)
     except Exception as e:
-        print
+        print(f"Error: {e}")
+        traceback.print_exc()
+    finally:
+        running = job_table.running() if job_table is not None else []
+        if running:
+            print(f"Cancelling {len(running)} running job(s).")
+        if job_table is not None:
+            job_table.cancel_all()  # also waits for finished jobs still being recorded
+        if shell_session is not None:
+            shell_session.close()
+        if response_cache is not None:
+            logging.info(f"Response cache stats: {response_cache.stats()}")
+            response_cache.close()
+        logging.info(f"Request scheduler stats: {request_scheduler.stats()}")
+        logging.info(f"Model routing stats: {model_router.stats()}")
+        if command_policy is not None:
+            logging.info(f"Command policy stats: {command_policy.stats()}")
+        if COMMAND_CANDIDATES > 1:
+            logging.info(f"Candidate fallback stats: {candidate_stats.stats()}")
+        if history_store is not None:
+            history_store.close()
+        if client_manager is not None:
+            client_manager.close()
+        log_listener.stop()  # flushes queued records
+
+if __name__ == "__main__":
+    main()
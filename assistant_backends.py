@@ -0,0 +1,228 @@
+"""
+Pluggable LLM backends.
+
+The assistant only uses a small part of the OpenAI-style client surface:
+client.chat.completions.create(...) (buffered or streamed) and
+client.models.list(). Every backend provides exactly that, so the completion
+call sites do not care which one they talk to:
+
+- "groq": the Groq SDK (default);
+- "openai": any OpenAI-compatible server, e.g. a local llama.cpp, vLLM or
+  Ollama endpoint at OPENAI_BASE_URL;
+- "fake": deterministic and offline. It replays recorded responses from
+  FAKE_LLM_RESPONSES and otherwise echoes the prompt, with configurable
+  latency, for benchmarks and load tests without network or API key.
+
+Set LLM_RECORD_FILE to record the responses of a real backend in the format the
+fake one replays.
+"""
+
+import json
+import os
+import shlex
+import threading
+import time
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+
+import httpx
+
+from assistant_cache import normalize_prompt
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "http://127.0.0.1:8080/v1")
+FAKE_LLM_RESPONSES = os.getenv("FAKE_LLM_RESPONSES", "")
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", 0.2))  # seconds to the first token
+FAKE_LLM_TOKEN_DELAY = float(os.getenv("FAKE_LLM_TOKEN_DELAY", 0.005))
+LLM_RECORD_FILE = os.getenv("LLM_RECORD_FILE", "")
+_CHARS_PER_CHUNK = 4  # roughly one token per streamed chunk
+
+
+class BackendError(Exception):
+    """HTTP error from an OpenAI-compatible server; carries status_code and response like the SDK errors."""
+
+    def __init__(self, response):
+        super().__init__(f"Error code: {response.status_code} - {response.text[:200]}")
+        self.status_code = response.status_code
+        self.response = response
+
+
+def _chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=content))])
+
+
+def _completion(content, prompt_tokens, completion_tokens, model):
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(index=0, message=SimpleNamespace(role="assistant", content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              total_tokens=prompt_tokens + completion_tokens),
+    )
+
+
+def _user_prompt(messages):
+    return next((m['content'] for m in reversed(messages) if m['role'] == "user"), "")
+
+
+class Backend(ABC):
+    """Base class: exposes create() and list_models() under the OpenAI-style attribute names."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.models = SimpleNamespace(list=self.list_models)
+
+    @abstractmethod
+    def create(self, messages, model, temperature=None, max_tokens=None, stream=False, response_format=None):
+        """A completion object, or an iterator of chunks when stream is set."""
+
+    def list_models(self):
+        return []
+
+
+class OpenAICompatibleBackend(Backend):
+    """Chat completions against any server that speaks the OpenAI HTTP API."""
+
+    def __init__(self, api_key=None, base_url=None, http_client=None, timeout=None, max_retries=0):
+        super().__init__()
+        self.base_url = (base_url or OPENAI_BASE_URL).rstrip("/")
+        self.http_client = http_client or httpx.Client(timeout=timeout)
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def _send(self, method, path, body=None, stream=False):
+        request = self.http_client.build_request(method, f"{self.base_url}{path}", json=body, headers=self.headers)
+        response = self.http_client.send(request, stream=stream)
+        if response.status_code >= 400:
+            response.read()
+            response.close()
+            raise BackendError(response)
+        return response
+
+    def create(self, messages, model, temperature=None, max_tokens=None, stream=False, response_format=None):
+        body = {"model": model, "messages": messages, "stream": stream}
+        if temperature is not None:
+            body["temperature"] = temperature
+        if max_tokens is not None:
+            body["max_tokens"] = max_tokens
+        if response_format is not None:
+            body["response_format"] = response_format
+        # Sent here rather than on first iteration so errors surface where the call is made
+        response = self._send("POST", "/chat/completions", body, stream=stream)
+        if stream:
+            return self._events(response)
+        data = response.json()
+        usage = data.get('usage') or {}
+        return _completion(data['choices'][0]['message']['content'],
+                           usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0), data.get('model', model))
+
+    def _events(self, response):
+        try:
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get('choices') or []
+                if choices:
+                    yield _chunk((choices[0].get('delta') or {}).get('content'))
+        finally:
+            response.close()
+
+    def list_models(self):
+        return self._send("GET", "/models").json().get('data', [])
+
+
+class FakeBackend(Backend):
+    """Offline backend: recorded or echoed answers with simulated latency, streamed like a real server."""
+
+    def __init__(self, api_key=None, base_url=None, http_client=None, timeout=None, max_retries=0,
+                 responses_file=FAKE_LLM_RESPONSES, latency=FAKE_LLM_LATENCY, token_delay=FAKE_LLM_TOKEN_DELAY):
+        super().__init__()
+        self.latency = latency
+        self.token_delay = token_delay
+        self.responses = {}
+        if responses_file and os.path.exists(responses_file):
+            with open(responses_file, "r") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[normalize_prompt(entry['prompt'])] = entry['response']
+
+    def answer(self, user_prompt):
+        """The recorded response for a prompt, else a command that echoes it."""
+        recorded = self.responses.get(normalize_prompt(user_prompt))
+        if recorded is not None:
+            return recorded
+        return json.dumps({"command": f"echo {shlex.quote(user_prompt)}"})
+
+    def create(self, messages, model, temperature=None, max_tokens=None, stream=False, response_format=None):
+        content = self.answer(_user_prompt(messages))
+        time.sleep(self.latency)
+        if stream:
+            return self._stream(content)
+        prompt_chars = sum(len(m['content']) for m in messages)
+        if self.token_delay:
+            time.sleep(self.token_delay * len(content) / _CHARS_PER_CHUNK)
+        return _completion(content, prompt_chars // _CHARS_PER_CHUNK, len(content) // _CHARS_PER_CHUNK + 1, model)
+
+    def _stream(self, content):
+        for i in range(0, len(content), _CHARS_PER_CHUNK):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield _chunk(content[i:i + _CHARS_PER_CHUNK])
+
+
+class RecordingBackend(Backend):
+    """Wraps a backend and appends {"prompt", "response"} lines that FakeBackend can replay."""
+
+    def __init__(self, backend, path=LLM_RECORD_FILE):
+        super().__init__()
+        self.backend = backend
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self.models = backend.models
+
+    def _record(self, messages, content):
+        line = json.dumps({"prompt": _user_prompt(messages), "response": content})
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+    def create(self, messages, model, temperature=None, max_tokens=None, stream=False, response_format=None):
+        options = {"temperature": temperature, "max_tokens": max_tokens, "response_format": response_format}
+        # Only pass what was given; the SDKs treat an explicit None differently from a missing option
+        result = self.backend.chat.completions.create(messages=messages, model=model, stream=stream,
+                                                      **{k: v for k, v in options.items() if v is not None})
+        if not stream:
+            self._record(messages, result.choices[0].message.content)
+            return result
+        return self._recorded_stream(messages, result)
+
+    def _recorded_stream(self, messages, stream):
+        # A stream cut early (see assistant_llm) records what was read, which still holds the command
+        parts = []
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                yield chunk
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+            self._record(messages, "".join(parts))
+
+
+BACKENDS = {
+    "openai": OpenAICompatibleBackend,
+    "fake": FakeBackend,
+}
+
+
+def backend_class(name=LLM_BACKEND):
+    """Client class for a backend name; "groq" is the Groq SDK, imported only when used."""
+    if name == "groq":
+        from groq import Groq
+        return Groq
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND '{name}', expected one of: groq, {', '.join(BACKENDS)}.")
+    return BACKENDS[name]
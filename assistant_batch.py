@@ -0,0 +1,73 @@
+"""
+Non-interactive batch runner for query files.
+
+LLM calls go through one bounded worker pool and the resulting commands
+through another, so slow round-trips overlap instead of queueing up. Results
+are yielded in the order of the input file.
+"""
+
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+BATCH_LLM_WORKERS = int(os.getenv("BATCH_LLM_WORKERS", 8))
+BATCH_EXEC_WORKERS = int(os.getenv("BATCH_EXEC_WORKERS", 4))
+
+
+def read_queries(path):
+    """Read one query per line, skipping blank lines and '#' comments."""
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def _generate(index, query, generate_command):
+    result = {'index': index, 'query': query, 'command': None, 'stdout': None, 'stderr': None,
+              'exit_code': None, 'llm_seconds': None, 'exec_seconds': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        result['command'] = generate_command(query)
+    except Exception as e:
+        result['error'] = f"Command generation failed: {e}"
+    result['llm_seconds'] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def _execute(result, run_command):
+    start = time.perf_counter()
+    try:
+        result['stdout'], result['stderr'], result['exit_code'] = run_command(result['command'])
+    except Exception as e:
+        result['error'] = f"Execution failed: {e}"
+    result['exec_seconds'] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def run_batch(queries, generate_command, run_command,
+              llm_workers=BATCH_LLM_WORKERS, exec_workers=BATCH_EXEC_WORKERS):
+    """
+    Turn each query into a command and run it, with bounded concurrency per stage.
+
+    `generate_command(query)` returns a command string and `run_command(command)`
+    returns (stdout, stderr, exit_code). Result dicts are yielded in input order
+    as soon as every earlier one is done.
+    """
+    slots = [Future() for _ in queries]
+
+    with ThreadPoolExecutor(max_workers=exec_workers) as exec_pool, \
+            ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+
+        def on_generated(index, llm_future):
+            result = llm_future.result()
+            if result['error']:
+                slots[index].set_result(result)
+                return
+            exec_future = exec_pool.submit(_execute, result, run_command)
+            exec_future.add_done_callback(lambda f: slots[index].set_result(f.result()))
+
+        for index, query in enumerate(queries):
+            llm_future = llm_pool.submit(_generate, index, query, generate_command)
+            llm_future.add_done_callback(lambda f, index=index: on_generated(index, f))
+
+        for slot in slots:
+            yield slot.result()
+
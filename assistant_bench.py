@@ -0,0 +1,520 @@
+"""
+Offline micro-benchmarks for the assistant.
+
+Usage: python assistant_bench.py <benchmark> [options]
+
+Every benchmark prints JSON lines so runs can be diffed or collected across
+commits. Nothing here needs network access or an API key.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def current_rss_kb():
+    """Resident set size of this process in KiB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+
+def emit(record):
+    print(json.dumps(record))
+    sys.stdout.flush()
+
+
+def bench_history_memory(args):
+    """Record many commands with large outputs and sample RSS along the way."""
+    from assistant_history import CommandHistory, HistoryRecord, HistoryStore
+
+    output = ("x" * 79 + "\n") * (args.output_kb * 1024 // 80)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(os.path.join(tmp, "history.sqlite3"))
+        history = CommandHistory(maxlen=args.window)
+        samples = []
+        start = time.perf_counter()
+        for i in range(1, args.commands + 1):
+            history_id = store.append(f"query {i}", f"echo {i}", True, output, None)
+            history.append(HistoryRecord(f"query {i}", f"echo {i}", True, output, None, history_id))
+            if i % args.sample_every == 0:
+                samples.append(current_rss_kb())
+                emit({'benchmark': 'history-memory', 'commands': i, 'rss_kb': samples[-1]})
+        elapsed = time.perf_counter() - start
+        store.close()
+
+    # Growth after warm-up: the window is full once the first sample is taken
+    emit({
+        'benchmark': 'history-memory',
+        'summary': True,
+        'commands': args.commands,
+        'output_kb': args.output_kb,
+        'window': args.window,
+        'rss_first_kb': samples[0],
+        'rss_last_kb': samples[-1],
+        'rss_growth_kb': samples[-1] - samples[0],
+        'append_us': round(elapsed / args.commands * 1e6, 2),
+    })
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Nearest-rank percentiles of a list of durations, in microseconds."""
+    ordered = sorted(samples)
+    return {f"p{p}_us": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1e6, 2) for p in points}
+
+
+_WORDS = ("list show find count open delete copy move compress search files folders notes movies pictures "
+          "python processes memory disk usage network ports logs downloads desktop documents backup archive "
+          "largest newest oldest hidden running installed version size git branch docker containers images").split()
+
+
+def synthetic_prompts(n, seed=0):
+    """
+    Deterministic prompts shaped like real ones: a few common words plus one or
+    two rarer names (files, folders, programs) drawn from a large pool.
+    """
+    import random
+    rng = random.Random(seed)
+    syllables = "ka lo mi ne ru sa ti vo ze pa qu ex an or el it un de re co".split()
+    names = ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(max(n // 5, 100))]
+    prompts = []
+    for _ in range(n):
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(2, 5))]
+        words += [rng.choice(names) for _ in range(rng.randint(1, 2))]
+        rng.shuffle(words)
+        prompts.append(" ".join(words))
+    return prompts
+
+
+def bench_history_search(args):
+    """Build the trigram index over a synthetic history and time fuzzy lookups."""
+    import random
+    from assistant_search import TrigramIndex
+
+    prompts = synthetic_prompts(args.entries)
+    index = TrigramIndex()
+    start = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        index.add(prompt, f"echo {i}", True)
+    build_seconds = time.perf_counter() - start
+
+    rng = random.Random(1)
+    queries = []
+    for _ in range(args.queries):
+        words = rng.choice(prompts).split()
+        rng.shuffle(words)
+        queries.append(" ".join(words[:max(2, len(words) - 1)]))
+
+    timings, hits = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        results = index.search(query)
+        timings.append(time.perf_counter() - start)
+        hits += bool(results)
+
+    emit({'benchmark': 'history-search', 'entries': args.entries, 'indexed_prompts': len(index),
+          'build_seconds': round(build_seconds, 3), 'queries': len(queries), 'queries_with_results': hits,
+          **percentiles(timings)})
+
+
+def bench_prompt_assembly(args):
+    """Cost of building the system prompt with and without the session-static prefix."""
+    from assistant_history import HistoryRecord
+    from assistant_prompt import _history_line, build_system_prompt, static_prompt
+
+    records = [HistoryRecord(f"query {i}", f"ls -la ~/dir{i} | grep {i}", i % 3 != 0, "out", "ls: No such file" * (i % 4))
+               for i in range(53)]
+
+    def rebuilt(i):
+        # What every request used to pay: render the whole template and every history line
+        prefix = static_prompt.__wrapped__("bash", "linux")
+        lines = [_history_line.__wrapped__(h.command, h.success, h.error, 80)[0] for h in records[i:i + 3]]
+        return prefix + "\n".join(lines)
+
+    def precompiled(i):
+        return build_system_prompt("bash", "linux", records[i:i + 3])
+
+    prefix = static_prompt("bash", "linux")
+    stable = all(precompiled(i).startswith(prefix) for i in range(min(args.iterations, 100)))
+    for name, build in (("rebuilt", rebuilt), ("precompiled", precompiled)):
+        timings = []
+        for i in range(args.iterations):
+            start = time.perf_counter()
+            build(i % 50)
+            timings.append(time.perf_counter() - start)
+        emit({'benchmark': 'prompt-assembly', 'variant': name, 'iterations': args.iterations,
+              'prefix_bytes': len(prefix.encode()), 'prefix_stable': stable, **percentiles(timings)})
+
+
+def bench_intent_router(args):
+    """Match cost of the compiled intent trie versus a linear prefix scan, as intents grow."""
+    import random
+    from assistant_router import Intent, IntentRouter
+
+    rng = random.Random(2)
+    for size in args.sizes:
+        prompts = list(dict.fromkeys(synthetic_prompts(size, seed=size)))
+        intents = [Intent(p + (" {arg}" if i % 5 == 0 else ""), f"echo {i}") for i, p in enumerate(prompts)]
+        router = IntentRouter(intents)
+        hits = [p + (" something" if i % 5 == 0 else "") for i, p in enumerate(prompts)]
+        misses = [p + " and then some more words" for p in prompts if not p.endswith("{arg}")]
+        queries = [rng.choice(hits) if i % 2 else rng.choice(misses) for i in range(args.queries)]
+
+        for variant, match in (("trie", router.match),
+                               ("linear-scan", lambda q: next((p for p in prompts if q.lower().startswith(p)), None))):
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                match(query)
+                timings.append(time.perf_counter() - start)
+            emit({'benchmark': 'intent-router', 'variant': variant, 'intents': router.size,
+                  'queries': len(queries), **percentiles(timings)})
+
+
+def bench_retrieval(args):
+    """Build the hashed TF-IDF retrieval index and time top-k cosine lookups."""
+    import random
+    from assistant_retrieval import RetrievalIndex
+
+    prompts = synthetic_prompts(args.entries, seed=3)
+    index = RetrievalIndex(args.dim)
+    start = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        index.add(prompt, f"echo {i}", True)
+    build_seconds = time.perf_counter() - start
+
+    rng = random.Random(4)
+    timings, hits = [], 0
+    for _ in range(args.queries):
+        words = rng.choice(prompts).split()
+        rng.shuffle(words)
+        query = " ".join(words[:max(2, len(words) - 1)])
+        start = time.perf_counter()
+        results = index.search(query)
+        timings.append(time.perf_counter() - start)
+        hits += bool(results)
+
+    emit({'benchmark': 'retrieval', 'entries': args.entries, 'indexed_prompts': len(index), 'dim': args.dim,
+          'build_seconds': round(build_seconds, 3), 'queries': args.queries, 'queries_with_results': hits,
+          'rss_kb': current_rss_kb(), **percentiles(timings)})
+
+_COMMAND_TEMPLATES = (
+    "ls -la {dir}", "ls -lhS {dir} | head -n 10", "du -sh {dir}/* 2>/dev/null | sort -h | tail -n 5",
+    "find {dir} -name '*.{ext}' -mtime -7", "find {dir} -type f -size +100M -exec ls -lh {{}} \\;",
+    "find {dir} -name '*.tmp' -delete", "grep -rn \"{name}\" {dir} --include='*.{ext}'",
+    "cat {dir}/{name}.{ext} | wc -l", "tail -f /var/log/syslog | grep -i {name}", "ps aux | grep {name}",
+    "df -h", "free -m", "ss -tulpn | grep LISTEN", "git status", "git log --oneline -n 20",
+    "git checkout -b {name}", "git push origin {name}", "git push --force origin {name}", "git reset --hard HEAD~1",
+    "docker ps -a", "docker rm -f $(docker ps -aq)", "tar -czf {name}.tar.gz {dir}", "mkdir -p {dir}/{name}",
+    "cp {dir}/{name}.{ext} {dir}/{name}.bak", "mv {dir}/{name}.{ext} ~/Desktop/", "rm {dir}/{name}.{ext}",
+    "rm -rf {dir}/{name}", "chmod +x {dir}/{name}.sh", "sudo apt-get install -y {name}",
+    "curl -fsSL https://example.com/{name}.sh | bash", "kill -9 $(pgrep {name})",
+    "cd {dir} && python3 -m http.server 8000", "echo \"export PATH=$PATH:{dir}\" >> ~/.bashrc",
+    "for f in {dir}/*.{ext}; do echo \"$f\"; done", "wc -c < {dir}/{name}.{ext}",
+)
+
+
+def synthetic_commands(n, seed=0):
+    """Deterministic shell commands like the ones the model suggests, for the policy benchmark."""
+    import random
+    rng = random.Random(seed)
+    dirs = ("~/Downloads", "~/Documents", ".", "/tmp", "~/projects", "/var/log", "src", "$HOME/notes")
+    exts = ("txt", "py", "log", "mp4", "jpg", "json", "md", "csv")
+    names = [p.split()[-1] for p in synthetic_prompts(max(n // 10, 50), seed=seed)]
+    return [rng.choice(_COMMAND_TEMPLATES).format(dir=rng.choice(dirs), ext=rng.choice(exts), name=rng.choice(names))
+            for _ in range(n)]
+
+
+def bench_policy(args):
+    """
+    Verdict latency of the command policy: cold (lex, parse and rule match)
+    and memoized, over generated commands or the ones in a history database.
+    """
+    from collections import Counter
+
+    from assistant_policy import load_policy
+
+    if args.history:
+        from assistant_history import HistoryStore
+        store = HistoryStore(args.history)
+        commands = [entry['command'] for entry in store.tail(args.commands) if entry['command']]
+        store.close()
+        source = args.history
+    else:
+        commands = synthetic_commands(args.commands, seed=6)
+        source = "synthetic"
+    if not commands:
+        raise SystemExit(f"No commands in {source}")
+
+    start = time.perf_counter()
+    policy = load_policy(args.policy) if args.policy else load_policy()
+    load_seconds = time.perf_counter() - start
+
+    verdicts = Counter()
+    timings = []
+    for command in commands:
+        start = time.perf_counter()
+        verdict = policy.evaluate(command)
+        timings.append(time.perf_counter() - start)
+        verdicts[verdict.action] += 1
+    emit({'benchmark': 'policy', 'variant': 'cold', 'source': source, 'commands': len(commands),
+          'distinct': len(set(commands)), 'rules': len(policy.rules), 'load_ms': round(load_seconds * 1000, 3),
+          'verdicts': dict(verdicts), **percentiles(timings)})
+
+    for command in commands:  # fill the memo
+        policy.check(command)
+    timings = []
+    for command in commands:
+        start = time.perf_counter()
+        policy.check(command)
+        timings.append(time.perf_counter() - start)
+    emit({'benchmark': 'policy', 'variant': 'memoized', 'source': source, 'commands': len(commands),
+          **policy.stats(), **percentiles(timings)})
+
+
+_STDERR_SAMPLES = (
+    "ls: cannot access '/no/such/dir': No such file or directory",
+    "bash: pythn: command not found",
+    "grep: warning: stray \\ before -",
+    "",
+)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def bench_pipeline(args):
+    """
+    Time each stage of one REPL turn against the offline fake LLM:
+    prompt construction, request serialization, LLM call, response parsing,
+    command policy check, process spawn and run, error tips, history update and logging.
+    """
+    import platform
+
+    from assistant_backends import FakeBackend
+    from assistant_exec import execute_command_streaming
+    from assistant_history import HistoryStore
+    from assistant_logging import setup_logging
+    from assistant_policy import load_policy
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep anything the assistant writes on import out of the working tree
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+            import additional_Improvements_added_5 as assistant
+        finally:
+            os.chdir(cwd)
+        assistant.history_store = HistoryStore(os.path.join(tmp, "history.sqlite3"))
+        assistant.retrieval_index = None  # timed by the retrieval benchmark
+        assistant.command_policy = load_policy()
+        # The logging stage measures what the REPL thread pays: formatting and enqueueing
+        log_listener = setup_logging(os.path.join(tmp, "assistant.log"))
+        backend = FakeBackend(responses_file=None, latency=args.llm_latency, token_delay=args.token_delay)
+
+        stages = ("prompt", "serialize", "llm", "parse", "sanitize", "exec", "tips", "history", "logging")
+        timings = {stage: [] for stage in stages}
+        prompts = synthetic_prompts(args.iterations + args.warmup, seed=5)
+        for i, user_prompt in enumerate(prompts):
+            t = [time.perf_counter()]
+            system_prompt = assistant.generate_system_prompt("bash", "linux", user_prompt)
+            t.append(time.perf_counter())
+            messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+            json.dumps({"model": assistant.GROQ_MODEL, "messages": messages, "temperature": 0.1,
+                        "max_tokens": 160, "response_format": {"type": "json_object"}}).encode()
+            t.append(time.perf_counter())
+            # Buffered like STREAM_COMPLETIONS=0, so parsing is a stage of its own
+            completion = backend.chat.completions.create(messages=messages, model=assistant.GROQ_MODEL,
+                                                         temperature=0.1, max_tokens=160)
+            t.append(time.perf_counter())
+            command = json.loads(completion.choices[0].message.content)['command']
+            t.append(time.perf_counter())
+            assistant.command_policy.check(command)
+            t.append(time.perf_counter())
+            stdout, stderr, exit_code, _ = execute_command_streaming(command, echo=False)
+            t.append(time.perf_counter())
+            tips = assistant.provide_helpful_tips(command, _STDERR_SAMPLES[i % len(_STDERR_SAMPLES)])
+            t.append(time.perf_counter())
+            assistant.update_command_history(user_prompt, command, exit_code == 0, stdout, None if exit_code == 0 else tips)
+            t.append(time.perf_counter())
+            assistant.log_command(user_prompt, command, exit_code == 0, stdout, None, i)
+            t.append(time.perf_counter())
+            if i >= args.warmup:
+                for stage, start, end in zip(stages, t, t[1:]):
+                    timings[stage].append(end - start)
+        assistant.history_store.close()
+        log_listener.stop()
+
+    meta = {'commit': _git_commit(), 'python': platform.python_version(), 'platform': sys.platform,
+            'iterations': args.iterations, 'llm_latency': args.llm_latency}
+    results = {}
+    for stage in stages:
+        results[stage] = percentiles(timings[stage])
+        emit({'benchmark': 'pipeline', 'stage': stage, **meta, **results[stage]})
+    totals = [sum(timings[stage][i] for stage in stages) for i in range(args.iterations)]
+    emit({'benchmark': 'pipeline', 'stage': 'total', **meta, **percentiles(totals)})
+
+    if args.compare:
+        compare_pipeline(args.compare, results, args.threshold)
+
+
+def bench_spawn(args):
+    """
+    Spawn latency and throughput of simple commands through the executor:
+    via /bin/sh, exec'd directly with fork/exec, with posix_spawn and in a
+    persistent session shell (one per worker).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import assistant_exec
+    from assistant_exec import execute_command_streaming
+    from assistant_shell import SESSION_SHELL, ShellSession
+
+    modes = {"shell": (False, False), "exec": (True, False)}
+    if hasattr(os, "posix_spawn"):
+        modes["posix_spawn"] = (True, True)
+    modes["session"] = (False, False)
+    defaults = assistant_exec.DIRECT_EXEC, assistant_exec.USE_POSIX_SPAWN
+    try:
+        for mode, (direct, posix_spawn) in modes.items():
+            assistant_exec.DIRECT_EXEC, assistant_exec.USE_POSIX_SPAWN = direct, posix_spawn
+            sessions = [None] * args.workers
+            if mode == "session":
+                sessions = [ShellSession(args.shell or SESSION_SHELL) for _ in range(args.workers)]
+                start = time.perf_counter()
+                sessions[0].start(":", echo=False).result()
+                emit({'benchmark': 'session-start', 'shell': sessions[0].path,
+                      'first_command_ms': round((time.perf_counter() - start) * 1000, 3)})
+            for command in args.commands:
+                for _ in range(args.warmup):
+                    execute_command_streaming(command, echo=False, session=sessions[0])
+                timings = []
+                for _ in range(args.iterations):
+                    start = time.perf_counter()
+                    _, _, exit_code, stats = execute_command_streaming(command, echo=False, session=sessions[0])
+                    timings.append(time.perf_counter() - start)
+                if stats['spawn'] != mode or exit_code != 0:
+                    raise SystemExit(f"'{command}' ran via {stats['spawn']} with exit code {exit_code}, expected {mode}")
+                emit({'benchmark': 'spawn', 'mode': mode, 'command': command, 'iterations': args.iterations,
+                      **percentiles(timings)})
+
+            # Throughput: every worker runs the commands back to back for the given time
+            deadline = time.perf_counter() + args.duration
+
+            def worker(i):
+                done = 0
+                while time.perf_counter() < deadline:
+                    execute_command_streaming(args.commands[(i + done) % len(args.commands)], echo=False,
+                                              session=sessions[i])
+                    done += 1
+                return done
+
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                completed = sum(pool.map(worker, range(args.workers)))
+            for session in sessions:
+                if session is not None:
+                    session.close()
+            emit({'benchmark': 'spawn-throughput', 'mode': mode, 'workers': args.workers, 'seconds': args.duration,
+                  'commands': completed, 'commands_per_second': round(completed / args.duration, 1)})
+    finally:
+        assistant_exec.DIRECT_EXEC, assistant_exec.USE_POSIX_SPAWN = defaults
+
+
+def compare_pipeline(baseline_path, results, threshold):
+    """Compare per-stage p50 against an earlier run's JSON lines; exit 1 on a regression over threshold."""
+    baseline = {}
+    with open(baseline_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('benchmark') == 'pipeline' and record.get('stage') in results:
+                baseline[record['stage']] = record
+    regressed = False
+    for stage, current in results.items():
+        if stage not in baseline:
+            continue
+        before, after = baseline[stage]['p50_us'], current['p50_us']
+        change = (after - before) / before if before else 0.0
+        regression = change > threshold
+        regressed |= regression
+        emit({'benchmark': 'pipeline-compare', 'stage': stage, 'baseline_commit': baseline[stage].get('commit'),
+              'baseline_p50_us': before, 'p50_us': after, 'change_pct': round(change * 100, 1),
+              'regression': regression})
+    if regressed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    history_memory = benchmarks.add_parser("history-memory", help="RSS over a long session of recorded commands")
+    history_memory.add_argument("--commands", type=int, default=10000)
+    history_memory.add_argument("--output-kb", type=int, default=16, help="size of each command's output")
+    history_memory.add_argument("--window", type=int, default=10, help="in-memory history length")
+    history_memory.add_argument("--sample-every", type=int, default=1000)
+    history_memory.set_defaults(run=bench_history_memory)
+
+    history_search = benchmarks.add_parser("history-search", help="fuzzy prompt lookup over a large history")
+    history_search.add_argument("--entries", type=int, default=100000)
+    history_search.add_argument("--queries", type=int, default=1000)
+    history_search.set_defaults(run=bench_history_search)
+
+    prompt_assembly = benchmarks.add_parser("prompt-assembly", help="system prompt build cost per request")
+    prompt_assembly.add_argument("--iterations", type=int, default=20000)
+    prompt_assembly.set_defaults(run=bench_prompt_assembly)
+
+    intent_router = benchmarks.add_parser("intent-router", help="local intent match cost vs number of intents")
+    intent_router.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    intent_router.add_argument("--queries", type=int, default=2000)
+    intent_router.set_defaults(run=bench_intent_router)
+
+    retrieval = benchmarks.add_parser("retrieval", help="few-shot retrieval over a large history (needs NumPy)")
+    retrieval.add_argument("--entries", type=int, default=100000)
+    retrieval.add_argument("--queries", type=int, default=1000)
+    retrieval.add_argument("--dim", type=int, default=128)
+    retrieval.set_defaults(run=bench_retrieval)
+
+    pipeline = benchmarks.add_parser("pipeline", help="per-stage latency of a REPL turn against the fake LLM")
+    pipeline.add_argument("--iterations", type=int, default=500)
+    pipeline.add_argument("--warmup", type=int, default=20)
+    pipeline.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds to the first token")
+    pipeline.add_argument("--token-delay", type=float, default=0.0, help="simulated seconds per streamed chunk")
+    pipeline.add_argument("--compare", metavar="BASELINE_JSONL", help="earlier pipeline output to compare against")
+    pipeline.add_argument("--threshold", type=float, default=0.2, help="p50 slowdown that counts as a regression")
+    pipeline.set_defaults(run=bench_pipeline)
+
+    policy = benchmarks.add_parser("policy", help="command policy verdict latency, cold and memoized")
+    policy.add_argument("--commands", type=int, default=4000, help="keep the distinct ones under POLICY_CACHE_SIZE")
+    policy.add_argument("--history", metavar="DB", help="use the commands recorded in this history database")
+    policy.add_argument("--policy", metavar="JSON", help="policy file (default: COMMAND_POLICY_FILE)")
+    policy.set_defaults(run=bench_policy)
+
+    spawn = benchmarks.add_parser("spawn", help="command spawn latency and throughput: shell, direct exec, session")
+    spawn.add_argument("--commands", nargs="+", default=["true", "echo hello", "ls /", "date"])
+    spawn.add_argument("--iterations", type=int, default=300)
+    spawn.add_argument("--warmup", type=int, default=20)
+    spawn.add_argument("--workers", type=int, default=4, help="concurrent commands for the throughput run")
+    spawn.add_argument("--duration", type=float, default=3.0, help="seconds per throughput run")
+    spawn.add_argument("--shell", help="shell for the session mode (default: SESSION_SHELL, else $SHELL)")
+    spawn.set_defaults(run=bench_spawn)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Persistent prompt -> command cache in front of the LLM.
+
+Entries are keyed on the normalized user prompt, shell, operating system,
+model and temperature, kept in a small SQLite file, and evicted by TTL and
+least-recent use. Only commands that ran successfully are stored, and an entry
+is dropped as soon as its command fails.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "response_cache.sqlite3")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 500))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 7 * 24 * 3600))  # seconds
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", prompt.lower()).strip().rstrip("?!. ")
+
+
+def cache_key(prompt, shell_name, operating_system, model, temperature) -> str:
+    """Build the cache key for a prompt in a given environment and model setup."""
+    parts = [normalize_prompt(prompt), shell_name, operating_system, model, float(temperature)]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU cache with TTL expiry, stored in SQLite."""
+
+    def __init__(self, path=RESPONSE_CACHE_FILE, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, prompt TEXT, command TEXT, created REAL, last_used REAL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.purge_expired()
+
+    def get(self, key):
+        """Return the cached command for a key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT command, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            command, created = row
+            if now - created > self.ttl:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return command
+
+    def put(self, key, prompt, command):
+        """Store a command and evict the least recently used entries beyond the size limit."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (key, prompt, command, now, now))
+            excess = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._db.execute("""DELETE FROM entries WHERE key IN (
+                    SELECT key FROM entries ORDER BY last_used LIMIT ?)""", (excess,))
+                self.evictions += excess
+
+    def invalidate(self, key):
+        """Drop an entry, e.g. because its command failed."""
+        with self._lock:
+            if self._db.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount:
+                self.invalidations += 1
+
+    def purge_expired(self):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+            self.evictions += cursor.rowcount
+
+    def stats(self):
+        """Return hit/miss counters for this session and the current entry count."""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': entries,
+        }
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,119 @@
+"""
+Warm, pooled LLM client.
+
+Owns the httpx connection pool behind the Groq client so that:
+- the TLS connection is opened in the background while the user types the
+  first prompt, instead of on the first query;
+- connections are kept alive between queries;
+- every call has connect/read timeouts;
+- connect, time-to-first-byte and total latency are recorded per request.
+
+The base URL (GROQ_BASE_URL) and the client class can be swapped, e.g. to
+run against a local HTTP stub or another backend (see assistant_backends).
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from assistant_backends import LLM_RECORD_FILE, RecordingBackend, backend_class
+
+LLM_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 30))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 8))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", 300))
+
+
+class RequestTiming:
+    """Latency breakdown of one HTTP request; connect is None when a pooled connection was reused."""
+
+    __slots__ = ('url', 'start', 'connect', 'ttfb', 'total', '_connect_started')
+
+    def __init__(self, url):
+        self.url = url
+        self.start = time.perf_counter()
+        self.connect = None
+        self.ttfb = None
+        self.total = None
+        self._connect_started = None
+
+    def trace(self, event, info):
+        """httpcore trace hook: turn connection events into timings."""
+        now = time.perf_counter()
+        if event == "connection.connect_tcp.started":
+            self._connect_started = now
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete") and self._connect_started:
+            self.connect = now - self._connect_started
+        elif event.endswith("receive_response_headers.complete"):
+            self.ttfb = now - self.start
+        elif event.endswith("response_closed.complete"):
+            self.total = now - self.start
+
+    def as_dict(self):
+        return {
+            'url': self.url,
+            'connect': round(self.connect, 4) if self.connect is not None else None,
+            'ttfb': round(self.ttfb, 4) if self.ttfb is not None else None,
+            'total': round(self.total, 4) if self.total is not None else None,
+        }
+
+
+class ClientManager:
+    """Builds the LLM client on a shared, timed keep-alive pool and can pre-warm it."""
+
+    def __init__(self, api_key, base_url=LLM_BASE_URL, client_class=None):
+        self.timings = deque(maxlen=200)
+        self._local = threading.local()
+        self.http_client = httpx.Client(
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE,
+                                keepalive_expiry=LLM_KEEPALIVE_SECONDS),
+            event_hooks={"request": [self._on_request]},
+        )
+        if client_class is None:
+            client_class = backend_class()
+        self.client = client_class(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self.http_client,
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            max_retries=0,  # retries and backoff are up to the request scheduler
+        )
+        if LLM_RECORD_FILE:
+            self.client = RecordingBackend(self.client, LLM_RECORD_FILE)
+
+    def _on_request(self, request):
+        timing = RequestTiming(str(request.url))
+        request.extensions["trace"] = self._tracer(timing)
+        self._local.last = timing
+
+    def _tracer(self, timing):
+        def trace(event, info):
+            timing.trace(event, info)
+            if event.endswith("response_closed.complete"):
+                self.timings.append(timing)
+                logging.info(f"LLM HTTP timing: {timing.as_dict()}")
+        return trace
+
+    def last_timing(self):
+        """Timing of the latest request made from the calling thread, or None."""
+        return getattr(self._local, "last", None)
+
+    def prewarm(self):
+        """Open a pooled connection in the background so the first query skips TCP/TLS setup."""
+        def warm():
+            try:
+                self.client.models.list()
+            except Exception as e:
+                logging.warning(f"LLM connection pre-warm failed: {e}")
+        thread = threading.Thread(target=warm, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self.http_client.close()
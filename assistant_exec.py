@@ -0,0 +1,639 @@
+"""
+Streaming command execution with bounded output capture.
+
+Output is forwarded to the terminal as it arrives; only a head block and a
+tail ring buffer of each stream are kept in memory for the history and the
+retry prompt. Byte and line counts always cover the full output.
+
+Each command runs in its own process group under its CommandLimits
+(assistant_limits): on a timeout, too much output or Ctrl-C the whole group is
+killed, so children of the shell do not outlive it.
+
+Commands without shell syntax (pipes, redirects, globs, variables, ...) are
+not handed to /bin/sh but started directly, with posix_spawn where available.
+"""
+
+import os
+import re
+import select
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from assistant_path import executable_index
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+STREAM_OUTPUT = os.getenv("STREAM_OUTPUT", "1") == "1"
+OUTPUT_MEMORY_CAP = int(os.getenv("OUTPUT_MEMORY_CAP", 64 * 1024))  # bytes kept per stream
+READ_CHUNK_SIZE = 64 * 1024
+KILL_GRACE_SECONDS = 2.0  # between SIGTERM and SIGKILL
+DIRECT_EXEC = os.getenv("DIRECT_EXEC", "1") == "1"
+USE_POSIX_SPAWN = os.getenv("POSIX_SPAWN", "1") == "1" and hasattr(os, "posix_spawn")
+_POSIX = os.name == "posix"
+
+# Anything the shell would expand or interpret; quotes alone are fine, shlex handles them
+_SHELL_SYNTAX = re.compile(r"[|&;<>()$`\\*?\[\]{}!#\n]")
+# Builtins and keywords that only mean something inside a shell
+_SHELL_ONLY = {
+    "cd", "export", "source", ".", "alias", "unalias", "set", "unset", "exit", "exec", "eval", "read", "ulimit",
+    "umask", "wait", "trap", "shift", "type", "hash", "history", "command", "builtin", "let", "local", "declare",
+    "typeset", "readonly", "return", "times", "getopts", "jobs", "fg", "bg", "disown", "shopt", "pushd", "popd",
+    "dirs", "time", "if", "then", "else", "fi", "for", "while", "until", "do", "done", "case", "esac", "function",
+    "select",
+}
+
+
+class BoundedCapture:
+    """Keep the first and last bytes of a stream while counting all of it."""
+
+    def __init__(self, memory_cap=OUTPUT_MEMORY_CAP):
+        self.head_limit = memory_cap // 2
+        self.tail_limit = memory_cap - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+        self.newlines = 0
+        self.last_byte = b""
+
+    def feed(self, data: bytes):
+        """Account for a chunk and keep whatever still fits the head or tail."""
+        if not data:
+            return
+        self.total_bytes += len(data)
+        self.newlines += data.count(b"\n")
+        self.last_byte = data[-1:]
+
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data[-self.tail_limit:] if self.tail_limit else b""
+            excess = len(self.tail) - self.tail_limit
+            if excess > 0:
+                del self.tail[:excess]
+
+    @property
+    def line_count(self) -> int:
+        if self.total_bytes and self.last_byte != b"\n":
+            return self.newlines + 1
+        return self.newlines
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > len(self.head) + len(self.tail)
+
+    def getvalue(self) -> str:
+        """Return the kept output, marking the omitted middle part if any."""
+        head = self.head.decode(errors="replace")
+        if not self.truncated:
+            return (head + self.tail.decode(errors="replace")).strip()
+        omitted = self.total_bytes - len(self.head) - len(self.tail)
+        tail = self.tail.decode(errors="replace")
+        return f"{head.rstrip()}\n... [{omitted} bytes omitted] ...\n{tail.lstrip()}".strip()
+
+
+def _pump(pipe, feed):
+    """Hand every chunk read from a pipe to feed() until EOF."""
+    read = getattr(pipe, "read1", pipe.read)
+    while True:
+        chunk = read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        feed(chunk)
+    pipe.close()
+
+
+def direct_argv(command):
+    """
+    (path, argv) to exec a command without a shell, or None if it needs one:
+    shell syntax, a variable assignment, a shell builtin or an unknown program.
+    """
+    if _SHELL_SYNTAX.search(command):
+        return None
+    if "~" in command and ("'" in command or '"' in command):
+        return None  # a quoted ~ must not be expanded, and shlex does not tell us which ones were
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if not argv or "=" in argv[0] or argv[0] in _SHELL_ONLY:
+        return None
+    argv = [os.path.expanduser(word) if word.startswith("~") else word for word in argv]
+    path = executable_index.which(argv[0])
+    return (path, argv) if path is not None else None
+
+
+class _ReapedProcess:
+    """
+    The part of the Popen interface used here: pid, stdout, stderr,
+    returncode, poll(), wait(timeout) and kill(). The child is reaped with
+    os.wait4, which also keeps its rusage (CPU time, to tell what killed it).
+    Subclasses start the process and then call _watch_exit().
+    """
+
+    args = None
+    pid = None
+    returncode = None
+    rusage = None
+
+    def _watch_exit(self):
+        self._lock = threading.Lock()
+        try:
+            self._pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            self._pidfd = None  # not Linux 5.3+: poll instead
+
+    def _exited(self):
+        """Called once the child was reaped."""
+
+    def _reap(self, blocking):
+        # Like Popen: one thread reaps, others only see returncode change
+        if self.returncode is None and self._lock.acquire(blocking):
+            try:
+                if self.returncode is None:
+                    try:
+                        pid, status, rusage = os.wait4(self.pid, 0 if blocking else os.WNOHANG)
+                    except ChildProcessError:
+                        pid, status, rusage = self.pid, 0, None  # reaped elsewhere, e.g. SIGCHLD ignored
+                    if pid:
+                        self.rusage = rusage
+                        self.returncode = os.waitstatus_to_exitcode(status)
+                        self._exited()
+                        if self._pidfd is not None:
+                            os.close(self._pidfd)
+                            self._pidfd = None
+            finally:
+                self._lock.release()
+        return self.returncode
+
+    def poll(self):
+        return self._reap(blocking=False)
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            return self._reap(blocking=True)
+        end = time.monotonic() + timeout
+        delay = 0.0005
+        while self.poll() is None:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            pidfd = self._pidfd
+            if pidfd is not None:
+                # Readable as soon as the process exits, so no polling delay; bounded in case another thread reaps it
+                try:
+                    select.select([pidfd], [], [], min(remaining, 0.05))
+                except (OSError, ValueError):
+                    pass
+            else:
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        return self.returncode
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class SpawnedProcess(_ReapedProcess):
+    """A process started with os.posix_spawn in its own process group, with stdout and stderr pipes."""
+
+    def __init__(self, path, argv, stdin=None):
+        self.args = argv
+        out_read, out_write = os.pipe()
+        err_read, err_write = os.pipe()
+        file_actions = [(os.POSIX_SPAWN_DUP2, out_write, 1), (os.POSIX_SPAWN_DUP2, err_write, 2)]
+        if stdin == subprocess.DEVNULL:
+            file_actions.append((os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0))
+        try:
+            # Python ignores SIGPIPE and SIGXFSZ; the command gets the defaults back like with Popen
+            self.pid = os.posix_spawn(path, argv, os.environ, file_actions=file_actions, setpgroup=0,
+                                      setsigdef=(signal.SIGPIPE, signal.SIGXFSZ))
+        except BaseException:
+            os.close(out_read)
+            os.close(err_read)
+            raise
+        finally:
+            os.close(out_write)
+            os.close(err_write)
+        self.stdout = open(out_read, "rb")
+        self.stderr = open(err_read, "rb")
+        self._watch_exit()
+
+
+class ForkedProcess(_ReapedProcess):
+    """
+    A process started by Popen, which can set rlimits between fork and exec,
+    in its own process group; reaped here rather than by Popen.
+    """
+
+    def __init__(self, args, limits=None, stdin=None, **kwargs):
+        self._popen = subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       **_group_kwargs(limits), **kwargs)
+        self.args = args
+        self.pid = self._popen.pid
+        self.stdout = self._popen.stdout
+        self.stderr = self._popen.stderr
+        self._watch_exit()
+
+    def _exited(self):
+        self._popen.returncode = self.returncode  # so Popen does not wait for it again
+
+
+def _group_kwargs(limits):
+    """Popen arguments that start the command in a new process group under its rlimits."""
+    if not _POSIX:
+        return {}
+    rlimits = limits.rlimits() if limits is not None else []
+    if not rlimits and sys.version_info >= (3, 11):
+        return {'process_group': 0}
+
+    def setup():
+        # Runs in the child between fork and exec
+        os.setpgid(0, 0)
+        for which, value in rlimits:
+            resource.setrlimit(which, value)
+
+    return {'preexec_fn': setup}
+
+
+def _foreground_terminal():
+    """File descriptor of our terminal if we are its foreground process group, else None."""
+    if not _POSIX:
+        return None
+    try:
+        fd = sys.stdin.fileno()
+        if os.isatty(fd) and os.tcgetpgrp(fd) == os.getpgrp():
+            return fd
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def _set_foreground(fd, pgid):
+    # tcsetpgrp from a background group raises SIGTTOU unless it is blocked
+    mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTTOU})
+    try:
+        os.tcsetpgrp(fd, pgid)
+    except OSError:
+        pass
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+
+
+def spawn_command(command, limits=None, terminal=None, stdin=None):
+    """
+    Start a command with stdout and stderr pipes in its own process group, so a
+    kill reaches every process it starts. Returns the process and how it was
+    started: "posix_spawn" or "exec" for a direct start, else "shell".
+    With a terminal fd the group also becomes the terminal's foreground group:
+    the command can read input and gets Ctrl-C itself.
+    """
+    direct = direct_argv(command) if DIRECT_EXEC and _POSIX else None
+    process = None
+    if direct is not None:
+        path, argv = direct
+        try:
+            # rlimits have to be set between fork and exec, which posix_spawn cannot do
+            if USE_POSIX_SPAWN and not (limits is not None and limits.rlimits()):
+                process, mode = SpawnedProcess(path, argv, stdin), "posix_spawn"
+            else:
+                process, mode = ForkedProcess(argv, limits, stdin, executable=path), "exec"
+        except OSError:
+            process = None  # e.g. a script without #! line, which only the shell runs
+    if process is None and _POSIX:
+        process, mode = ForkedProcess(command, limits, stdin, shell=True), "shell"
+    elif process is None:
+        process, mode = subprocess.Popen(command, shell=True, stdin=stdin, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE), "shell"
+    if terminal is not None:
+        _set_foreground(terminal, process.pid)
+        try:
+            # It may have read the terminal before the hand-over and been stopped
+            os.killpg(process.pid, signal.SIGCONT)
+        except ProcessLookupError:
+            pass
+    return process, mode
+
+
+def proc_stat(pid):
+    """The fields of /proc/<pid>/stat after the command name (state first), or None without /proc."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # pid (comm) state ppid pgrp ...; comm may contain spaces and parentheses
+    return stat[stat.rfind(b")") + 2:].split()
+
+
+def group_stopped(pgid):
+    """
+    True if a process in the process group is stopped. Reads /proc where there
+    is one, as the stopped process is often a grandchild (the shell's child);
+    elsewhere only our own children are seen, through waitid.
+    """
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        pids = None
+    if pids is None:
+        try:
+            return os.waitid(os.P_PGID, pgid, os.WSTOPPED | os.WNOHANG | os.WNOWAIT) is not None
+        except (AttributeError, ChildProcessError, OSError):
+            return False
+    for pid in pids:
+        fields = proc_stat(pid)
+        if fields is not None and fields[0] == b"T" and int(fields[2]) == pgid:
+            return True
+    return False
+
+
+def kill_process_group(process, grace=KILL_GRACE_SECONDS):
+    """SIGTERM the command's process group, then SIGKILL whatever is left after the grace period."""
+    if not _POSIX:
+        process.kill()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(grace)
+        except subprocess.TimeoutExpired:
+            pass
+        os.killpg(process.pid, signal.SIGKILL)  # also children that ignored SIGTERM
+    except ProcessLookupError:
+        pass
+
+
+class _GroupKiller:
+    """Kills a process group once and remembers why."""
+
+    def __init__(self, process):
+        self.process = process
+        self.reason = None
+        self._lock = threading.Lock()
+
+    def kill(self, reason):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+        kill_process_group(self.process)
+
+
+def _limit_signal_reason(exit_code, limits, rusage=None):
+    """
+    Name the rlimit that killed the command, from its exit code (-signal, or
+    128+signal via the shell). A SIGKILL only counts as the hard CPU limit when
+    the rusage from wait4 shows the CPU time got there; the OOM killer or a
+    'kill -9' inside the command are not limits.
+    """
+    if limits is None or not _POSIX:
+        return None
+    for sig, reason in ((signal.SIGXCPU, "cpu"), (signal.SIGXFSZ, "file_size")):
+        if exit_code in (-sig, 128 + sig):
+            return reason
+    if limits.cpu_seconds and rusage is not None and exit_code in (-signal.SIGKILL, 128 + signal.SIGKILL):
+        if rusage.ru_utime + rusage.ru_stime >= max(1, int(limits.cpu_seconds)):
+            return "cpu"  # the hard CPU limit
+    return None
+
+
+def kill_message(reason, limits):
+    """Human-readable description of why a command was killed."""
+    if reason == "timeout":
+        return f"timed out after {limits.timeout:g}s"
+    if reason == "output":
+        return f"output exceeded {limits.output_mb:g} MB"
+    if reason == "cpu":
+        return f"CPU time limit of {limits.cpu_seconds:g}s reached"
+    if reason == "file_size":
+        return f"file size limit of {limits.output_mb:g} MB reached"
+    return reason
+
+
+class RunningCommand:
+    """
+    A started command: its process group, bounded output capture and kill
+    switch. Output is echoed while the command is attached to the terminal; a
+    detached command keeps running in the background and attach() shows it
+    again.
+    """
+
+    def __init__(self, command, limits=None, echo=True, memory_cap=OUTPUT_MEMORY_CAP):
+        self.command = command
+        self.limits = limits
+        self.terminal = _foreground_terminal() if echo else None
+        self.reads_terminal = self.terminal is not None  # stdin is the terminal, also once detached
+        # Without the terminal a read from it would stop the command, so it gets no input at all
+        self.process, self.spawn_mode = spawn_command(command, limits, self.terminal,
+                                                      stdin=None if echo else subprocess.DEVNULL)
+        self.started = time.monotonic()
+        self.deadline = self.started + limits.timeout if limits is not None and limits.timeout else None
+        self.echo = echo
+        self.out = BoundedCapture(memory_cap)
+        self.err = BoundedCapture(memory_cap)
+        self._output_limit = limits.output_bytes if limits is not None else 0
+        self._lock = threading.Lock()
+        self._killer = _GroupKiller(self.process)
+        self._result = None
+        if echo:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        self._readers = [
+            threading.Thread(target=_pump, args=(self.process.stdout, self._feeder(self.out, sys.stdout)), daemon=True),
+            threading.Thread(target=_pump, args=(self.process.stderr, self._feeder(self.err, sys.stderr)), daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+
+    def _feeder(self, capture, stream):
+        def feed(data):
+            with self._lock:
+                capture.feed(data)
+                if self.echo:
+                    stream.buffer.write(data)
+                    stream.buffer.flush()
+            if self._output_limit and self.out.total_bytes + self.err.total_bytes > self._output_limit:
+                self.kill("output")
+        return feed
+
+    @property
+    def killed(self):
+        """Why the command was killed, or None."""
+        return self._killer.reason
+
+    def kill(self, reason):
+        self._killer.kill(reason)
+
+    def _wait_exit(self, timeout=None):
+        """The exit code; raises subprocess.TimeoutExpired if the command still runs after `timeout` seconds."""
+        return self.process.wait(timeout)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the command to exit, killing it at its deadline. Returns the
+        exit code, or None if it is still running after `timeout` seconds.
+        """
+        until = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            ends = [t for t in (self.deadline, until) if t is not None]
+            try:
+                return self._wait_exit(max(0.0, min(ends) - time.monotonic()) if ends else None)
+            except subprocess.TimeoutExpired:
+                now = time.monotonic()
+                if self.deadline is not None and now >= self.deadline:
+                    self.kill("timeout")
+                    return self._wait_exit()
+                if until is not None and now >= until:
+                    return None
+
+    def detach(self):
+        """Stop echoing and take the terminal back; the command keeps running."""
+        with self._lock:
+            self.echo = False
+        self._release_terminal()
+
+    def attach(self):
+        """
+        Print the output kept so far, then echo the rest as it arrives. A
+        command whose stdin is the terminal gets it back as the foreground
+        process group; the group is continued in case a read from the terminal
+        stopped it while it was detached. detach() takes the terminal back.
+        """
+        with self._lock:
+            for capture, stream in ((self.out, sys.stdout), (self.err, sys.stderr)):
+                kept = capture.getvalue()
+                if kept:
+                    stream.write(kept + "\n")
+                    stream.flush()
+            self.echo = True
+        if self.reads_terminal and self.terminal is None:
+            terminal = _foreground_terminal()
+            if terminal is not None:
+                _set_foreground(terminal, self.process.pid)
+                self.terminal = terminal
+        if _POSIX:
+            try:
+                os.killpg(self.process.pid, signal.SIGCONT)
+            except ProcessLookupError:
+                pass
+
+    @property
+    def stopped(self):
+        """True while a process of the command's group is stopped, e.g. by SIGTTIN."""
+        return _POSIX and self.process.returncode is None and group_stopped(self.process.pid)
+
+    def _release_terminal(self):
+        if self.terminal is not None:
+            _set_foreground(self.terminal, os.getpgrp())
+            self.terminal = None
+
+    def _interrupted(self, exit_code):
+        """'interrupted' if a command holding the terminal died of the user's Ctrl-C, else None."""
+        if self.reads_terminal and _POSIX and exit_code in (-signal.SIGINT, 128 + signal.SIGINT):
+            return "interrupted"
+        return None
+
+    def _cpu_seconds(self):
+        """User + system CPU time of the command and the children it waited for, from wait4."""
+        rusage = getattr(self.process, 'rusage', None)
+        return round(rusage.ru_utime + rusage.ru_stime, 6) if rusage is not None else None
+
+    def result(self):
+        """(stdout, stderr, exit_code, stats) once the command has exited; see execute_command_streaming."""
+        if self._result is None:
+            exit_code = self._wait_exit()
+            self._release_terminal()
+            for reader in self._readers:
+                # A process that left the group could keep the pipes open
+                reader.join(KILL_GRACE_SECONDS if self.killed else None)
+            stats = output_stats(self.out, self.err, self.killed or _limit_signal_reason(
+                exit_code, self.limits, getattr(self.process, 'rusage', None)) or self._interrupted(exit_code))
+            stats['spawn'] = self.spawn_mode
+            stats['cpu_seconds'] = self._cpu_seconds()
+            stderr = self.err.getvalue()
+            if stats['killed']:
+                stderr = f"{stderr}\n[killed: {kill_message(stats['killed'], self.limits)}]".strip()
+            self._result = (self.out.getvalue(), stderr, exit_code, stats)
+        return self._result
+
+
+class CommandDetached(Exception):
+    """A foreground command outlived detach_after and now runs in the background."""
+
+    def __init__(self, run):
+        super().__init__(f"Command detached: {run.command}")
+        self.run = run
+
+
+def execute_command_streaming(command, echo=True, memory_cap=OUTPUT_MEMORY_CAP, limits=None, detach_after=None,
+                              session=None):
+    """
+    Execute a shell command, forwarding its output as it arrives. With a
+    session (assistant_shell.ShellSession) it runs in that session's shell.
+
+    Returns (stdout, stderr, exit_code, stats) where stdout/stderr hold at most
+    `memory_cap` bytes each and stats has byte and line counts for the full output,
+    plus 'killed' with the reason when a limit or Ctrl-C ("interrupted")
+    stopped the command and
+    'cpu_seconds' (None where it cannot be measured).
+    Raises CommandDetached with the still running command if it takes longer
+    than detach_after seconds.
+    """
+    try:
+        if session is not None:
+            run = session.start(command, limits, echo, memory_cap)
+        else:
+            run = RunningCommand(command, limits, echo, memory_cap)
+    except Exception as e:
+        return "", str(e), 1, output_stats(BoundedCapture(0), BoundedCapture(0))
+    try:
+        if run.wait(detach_after) is None:
+            run.detach()
+            raise CommandDetached(run)
+    except KeyboardInterrupt:
+        run.kill("interrupted")
+    return run.result()
+
+
+def execute_command_captured(command, limits=None):
+    """
+    Execute a command without echoing it and return its complete output once
+    it exits, as (stdout, stderr, exit_code, stats) like execute_command_streaming.
+    """
+    return execute_command_streaming(command, echo=False, memory_cap=sys.maxsize, limits=limits)
+
+
+def output_stats(out_capture, err_capture, killed=None):
+    """Summarize the full size of both output streams."""
+    return {
+        'stdout_bytes': out_capture.total_bytes,
+        'stdout_lines': out_capture.line_count,
+        'stderr_bytes': err_capture.total_bytes,
+        'stderr_lines': err_capture.line_count,
+        'truncated': out_capture.truncated or err_capture.truncated,
+        'killed': killed,
+    }
+
+
+def format_output_stats(stats, limits=None) -> str:
+    """Render output stats as a one-line summary for the REPL."""
+    summary = (f"[stdout: {stats['stdout_bytes']} bytes, {stats['stdout_lines']} lines; "
+               f"stderr: {stats['stderr_bytes']} bytes, {stats['stderr_lines']} lines")
+    if stats['truncated']:
+        summary += "; only head and tail kept"
+    if stats.get('killed'):
+        summary += f"; killed: {kill_message(stats['killed'], limits)}"
+    return summary + "]"
+
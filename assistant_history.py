@@ -0,0 +1,190 @@
+"""
+Command history: a compact in-memory window and an append-only store.
+
+History lives in a SQLite database in WAL mode: every command is a single
+INSERT, only the tail needed for the system prompt is read at startup, and
+several terminals can write to the same file safely. In memory, only a
+bounded deque of slotted records is kept, with outputs reduced to a short
+preview, a digest and the id of the full row in the store.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+HISTORY_DB_FILE = os.getenv("HISTORY_DB_FILE", "command_history.sqlite3")
+HISTORY_BUSY_TIMEOUT_MS = 5000
+OUTPUT_PREVIEW_LENGTH = int(os.getenv("OUTPUT_PREVIEW_LENGTH", 200))  # characters kept in memory
+ERROR_PREVIEW_LENGTH = int(os.getenv("ERROR_PREVIEW_LENGTH", 1000))
+
+
+def _preview(text, limit):
+    if text is None or len(text) <= limit:
+        return text
+    return text[:limit] + f"... [{len(text) - limit} more characters]"
+
+
+class HistoryRecord:
+    """One executed command; the full output stays in the store under history_id."""
+
+    __slots__ = ('user_prompt', 'command', 'success', 'output', 'output_size', 'output_digest', 'error', 'history_id')
+
+    def __init__(self, user_prompt, command, success, output=None, error=None, history_id=None):
+        self.user_prompt = user_prompt
+        self.command = command
+        self.success = success
+        self.output = _preview(output, OUTPUT_PREVIEW_LENGTH)
+        self.output_size = len(output) if output is not None else 0
+        self.output_digest = hashlib.sha1(output.encode(errors="replace")).hexdigest() if output else None
+        self.error = _preview(error, ERROR_PREVIEW_LENGTH)
+        self.history_id = history_id
+
+    @classmethod
+    def from_entry(cls, entry):
+        return cls(entry['user_prompt'], entry['command'], entry['success'],
+                   entry['output'], entry['error'], entry.get('id'))
+
+    def __repr__(self):
+        return f"HistoryRecord({self.command!r}, success={self.success}, history_id={self.history_id})"
+
+
+class CommandHistory:
+    """Fixed-size window of the most recent HistoryRecords."""
+
+    def __init__(self, maxlen):
+        self._records = deque(maxlen=maxlen)
+
+    def append(self, record):
+        self._records.append(record)
+
+    def extend(self, records):
+        self._records.extend(records)
+
+    def clear(self):
+        self._records.clear()
+
+    def recent(self, n):
+        """Return the last n records, oldest first."""
+        if n <= 0:
+            return []
+        start = max(len(self._records) - n, 0)
+        return [self._records[i] for i in range(start, len(self._records))]
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+
+_COLUMNS = "id, timestamp, user_prompt, command, success, output, error"
+
+
+def _row_to_entry(row):
+    return {
+        'id': row[0],
+        'timestamp': row[1],
+        'user_prompt': row[2],
+        'command': row[3],
+        'success': bool(row[4]),
+        'output': row[5],
+        'error': row[6],
+    }
+
+
+class HistoryStore:
+    """Indexed, append-only history shared by every assistant session."""
+
+    def __init__(self, path=HISTORY_DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                   timeout=HISTORY_BUSY_TIMEOUT_MS / 1000)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA busy_timeout={HISTORY_BUSY_TIMEOUT_MS}")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp REAL NOT NULL,
+            user_prompt TEXT,
+            command TEXT,
+            success INTEGER NOT NULL,
+            output TEXT,
+            error TEXT)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_user_prompt ON history (user_prompt)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_command ON history (command)")
+
+    def append(self, user_prompt, command, success, output=None, error=None) -> int:
+        """Append one entry and return its id."""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO history (timestamp, user_prompt, command, success, output, error) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), user_prompt, command, int(bool(success)), output, error))
+            return cursor.lastrowid
+
+    def get(self, history_id):
+        """Return the full entry for an id, e.g. to expand a truncated record."""
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM history WHERE id = ?", (history_id,)).fetchone()
+        return _row_to_entry(row) if row else None
+
+    def tail(self, n):
+        """Return the last n entries, oldest first."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT {_COLUMNS} FROM history ORDER BY id DESC LIMIT ?", (n,)).fetchall()
+        return [_row_to_entry(row) for row in reversed(rows)]
+
+    def since(self, last_id, limit=None):
+        """Return entries with an id greater than last_id, oldest first."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT {_COLUMNS} FROM history WHERE id > ? ORDER BY id LIMIT ?",
+                                    (last_id, -1 if limit is None else limit)).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def prompts_since(self, last_id):
+        """Return (id, user_prompt, command, success) for entries after last_id, without outputs."""
+        with self._lock:
+            rows = self._db.execute("SELECT id, user_prompt, command, success FROM history WHERE id > ? ORDER BY id",
+                                    (last_id,)).fetchall()
+        return [(row[0], row[1], row[2], bool(row[3])) for row in rows]
+
+    def find_by_prompt(self, user_prompt, limit=10):
+        """Return the most recent entries for an exact prompt, newest first."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT {_COLUMNS} FROM history WHERE user_prompt = ? ORDER BY id DESC LIMIT ?",
+                                    (user_prompt, limit)).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def find_by_command(self, command, limit=10):
+        """Return the most recent entries that ran an exact command, newest first."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT {_COLUMNS} FROM history WHERE command = ? ORDER BY id DESC LIMIT ?",
+                                    (command, limit)).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def import_json(self, json_path) -> int:
+        """One-off migration of an old command_history.json list; returns the number of entries imported."""
+        if not os.path.exists(json_path) or self.count():
+            return 0
+        with open(json_path, "r") as f:
+            entries = json.load(f)
+        rows = [(time.time(), h.get('user_prompt'), h.get('command'), int(bool(h.get('success'))),
+                 h.get('output'), h.get('error')) for h in entries]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO history (timestamp, user_prompt, command, success, output, error) VALUES (?, ?, ?, ?, ?, ?)",
+                rows)
+            self._db.execute("COMMIT")
+        return len(rows)
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,160 @@
+"""
+Background jobs for the REPL.
+
+A command runs as a job when the query or the command ends with a single '&',
+or when it is still running JOB_DETACH_SECONDS after it started in the
+foreground. The prompt comes back at once:
+- 'jobs' lists the jobs;
+- 'fg N' shows a job's output and follows it until it exits (Ctrl-C detaches
+  again). A job whose input is the terminal gets the terminal back and is
+  continued, as a read from it while detached stops it ('Stopped' in 'jobs');
+  Ctrl-C then goes to the job like to any foreground command;
+- 'cancel N' kills its process group.
+When a job exits the user is notified and on_finish records it in the history
+like any foreground command.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from assistant_exec import KILL_GRACE_SECONDS
+
+JOB_DETACH_SECONDS = float(os.getenv("JOB_DETACH_SECONDS", 30))  # 0 keeps foreground commands attached
+MAX_FINISHED_JOBS = 20  # finished jobs kept for 'jobs' and 'fg'
+
+
+def split_background(text):
+    """Strip a trailing single '&': ('sleep 5', True) for 'sleep 5 &', else (text, False)."""
+    stripped = text.rstrip()
+    if stripped.endswith("&") and not stripped.endswith(("&&", "\\&", ">&", "|&")):
+        return stripped[:-1].rstrip(), True
+    return text, False
+
+
+class Job:
+    """A detached RunningCommand and what to record once it exits."""
+
+    __slots__ = ('id', 'user_prompt', 'run', 'context', 'started', 'ended', 'result', 'done')
+
+    def __init__(self, job_id, user_prompt, run, context=None):
+        self.id = job_id
+        self.user_prompt = user_prompt
+        self.run = run
+        self.context = context
+        self.started = run.started  # a detached foreground command counts from its start
+        self.ended = None
+        self.result = None  # (stdout, stderr, exit_code, stats) once it exited
+        self.done = threading.Event()
+
+    @property
+    def command(self):
+        return self.run.command
+
+    @property
+    def state(self):
+        if self.result is None:
+            return "Stopped" if self.run.stopped else "Running"
+        if self.result[3]['killed']:
+            return f"Killed ({self.result[3]['killed']})"
+        return "Done" if self.result[2] == 0 else f"Exit {self.result[2]}"
+
+    @property
+    def exited(self):
+        """Whether the command exited, also before the watcher has recorded it."""
+        return self.result is not None or self.run.wait(0) is not None
+
+    @property
+    def runtime(self):
+        return (self.ended or time.monotonic()) - self.started
+
+    def describe(self):
+        return f"[{self.id}] {self.state:<20} {self.runtime:7.1f}s  {self.command}"
+
+
+class JobTable:
+    """Running and recently finished jobs; a watcher thread per job waits for it and reports back."""
+
+    def __init__(self, on_finish=None):
+        self.on_finish = on_finish
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, run, user_prompt, context=None, started=None):
+        """
+        Track a started, detached RunningCommand as a job. started(job) runs
+        before the watcher, so its message comes before the job's exit is reported.
+        """
+        job = Job(next(self._ids), user_prompt, run, context)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.done.is_set()]
+            for old in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[old.id]
+        if started is not None:
+            started(job)
+        threading.Thread(target=self._watch, args=(job,), name=f"job-{job.id}", daemon=True).start()
+        logging.info(f"Job {job.id} started: {job.command}")
+        return job
+
+    def _watch(self, job):
+        job.run.wait()
+        job.result = job.run.result()
+        job.ended = time.monotonic()
+        print(f"\n{job.describe()}", flush=True)
+        logging.info(f"Job {job.id} finished: {job.state} after {job.runtime:.1f}s: {job.command}")
+        try:
+            if self.on_finish is not None:
+                self.on_finish(job)
+        except Exception as e:
+            logging.error(f"Recording job {job.id} failed: {e}")
+        finally:
+            job.done.set()
+
+    def get(self, job_id=None):
+        """A job by id, or the latest one when job_id is None."""
+        with self._lock:
+            if job_id is None:
+                return next(reversed(self._jobs.values()), None)
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def running(self):
+        """Jobs whose command has not exited yet."""
+        return [job for job in self.jobs() if not job.done.is_set() and not job.exited]
+
+    def follow(self, job):
+        """
+        Show a job's output so far and echo the rest until it exits; Ctrl-C
+        detaches it again. A job reading the terminal is put in the foreground
+        and continued, and the terminal taken back when it exits or detaches.
+        """
+        job.run.attach()
+        try:
+            job.done.wait()
+        except KeyboardInterrupt:
+            print(f"\n[{job.id}] Detached, still running.")
+        finally:
+            job.run.detach()
+
+    def cancel(self, job):
+        """Kill a running job's process group; returns False if it had already exited."""
+        if job.done.is_set() or job.exited:
+            return False
+        job.run.kill("cancelled")
+        return True
+
+    def cancel_all(self):
+        """Cancel every running job and wait until each job is recorded; returns how many were cancelled."""
+        pending = [job for job in self.jobs() if not job.done.is_set()]
+        cancelled = [job for job in pending if self.cancel(job)]
+        for job in pending:
+            job.done.wait(KILL_GRACE_SECONDS + 1)
+        return len(cancelled)
@@ -0,0 +1,140 @@
+"""
+Per-command timeouts and resource limits.
+
+Every command gets a wall-clock timeout, and optionally CPU-time, address
+space and output-size limits. The defaults come from the environment. The
+JSON file COMMAND_LIMITS_FILE can override them per command class, where a
+class is a set of programs, e.g. pagers and monitors get a short timeout and
+searches an output cap. Intents in intents.json can carry their own "limits".
+Limit keys: timeout, cpu_seconds, memory_mb, output_mb; 0 means unlimited.
+"""
+
+import json
+import os
+import re
+import shlex
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+COMMAND_TIMEOUT = float(os.getenv("COMMAND_TIMEOUT", 300))  # wall-clock seconds
+COMMAND_CPU_SECONDS = float(os.getenv("COMMAND_CPU_SECONDS", 0))
+COMMAND_MEMORY_MB = float(os.getenv("COMMAND_MEMORY_MB", 0))
+COMMAND_OUTPUT_MB = float(os.getenv("COMMAND_OUTPUT_MB", 0))
+COMMAND_LIMITS_FILE = os.getenv("COMMAND_LIMITS_FILE",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "command_limits.json"))
+
+_MB = 1024 * 1024
+_KEYS = ('timeout', 'cpu_seconds', 'memory_mb', 'output_mb')
+_SEGMENT_SPLIT = re.compile(r"\|\|?|&&|;|\n|\$\(|`")
+_ASSIGNMENT = re.compile(r"^\w+=")
+_WRAPPERS = {"sudo", "time", "nice", "nohup", "env", "command", "exec"}
+
+
+class CommandLimits:
+    """Timeout and rlimits for one command; 0 means unlimited."""
+
+    __slots__ = ('timeout', 'cpu_seconds', 'memory_mb', 'output_mb', 'label')
+
+    def __init__(self, timeout=0, cpu_seconds=0, memory_mb=0, output_mb=0, label="default"):
+        self.timeout = float(timeout)
+        self.cpu_seconds = float(cpu_seconds)
+        self.memory_mb = float(memory_mb)
+        self.output_mb = float(output_mb)
+        self.label = label
+
+    def merged(self, overrides, label):
+        """A copy with the given limit keys replaced."""
+        unknown = set(overrides) - set(_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown command limit(s) {', '.join(sorted(unknown))} for '{label}'.")
+        values = {key: getattr(self, key) for key in _KEYS}
+        values.update(overrides)
+        return CommandLimits(label=label, **values)
+
+    @property
+    def output_bytes(self):
+        return int(self.output_mb * _MB)
+
+    def rlimits(self):
+        """(resource, (soft, hard)) pairs to set in the child before it runs the command."""
+        if resource is None:
+            return []
+        limits = []
+        if self.cpu_seconds:
+            # SIGXCPU at the soft limit, SIGKILL a second later if it is caught
+            seconds = max(1, int(self.cpu_seconds))
+            limits.append((resource.RLIMIT_CPU, (seconds, seconds + 1)))
+        if self.memory_mb:
+            limits.append((resource.RLIMIT_AS, (int(self.memory_mb * _MB),) * 2))
+        if self.output_mb:
+            # Files the command writes; pipe output is counted by the reader
+            limits.append((resource.RLIMIT_FSIZE, (self.output_bytes,) * 2))
+        return limits
+
+    def as_dict(self):
+        return {'label': self.label, **{key: getattr(self, key) for key in _KEYS if getattr(self, key)}}
+
+    def __repr__(self):
+        return f"CommandLimits({self.as_dict()})"
+
+
+def command_programs(command):
+    """Program names of each pipeline or list segment, e.g. 'find . | wc -l' -> ['find', 'wc']."""
+    programs = []
+    for segment in _SEGMENT_SPLIT.split(command):
+        try:
+            words = shlex.split(segment)
+        except ValueError:
+            words = segment.split()
+        for word in words:
+            if _ASSIGNMENT.match(word) or word in _WRAPPERS or word.startswith("-") or word in ("(", "{"):
+                continue
+            programs.append(os.path.basename(word))
+            break
+    return programs
+
+
+class LimitPolicy:
+    """Resolves the limits for a command from the defaults, its program class and intent overrides."""
+
+    def __init__(self, default=None, classes=()):
+        self.default = default or CommandLimits(COMMAND_TIMEOUT, COMMAND_CPU_SECONDS, COMMAND_MEMORY_MB,
+                                                COMMAND_OUTPUT_MB)
+        self.classes = {}  # program -> CommandLimits of its class
+        for name, programs, limits in classes:
+            for program in programs:
+                self.classes.setdefault(program, limits)
+
+    @classmethod
+    def from_file(cls, path=COMMAND_LIMITS_FILE):
+        with open(path, "r") as f:
+            data = json.load(f)
+        default = cls().default.merged(data.get('default', {}), "default")
+        classes = []
+        for name, entry in data.get('classes', {}).items():
+            entry = dict(entry)
+            programs = entry.pop('programs', [])
+            classes.append((name, programs, default.merged(entry, name)))
+        return cls(default, classes)
+
+    def resolve(self, command, overrides=None, label=None):
+        """Limits for a command: the class of its first classified program, then any intent overrides."""
+        limits = self.default
+        if self.classes:
+            for program in command_programs(command):
+                if program in self.classes:
+                    limits = self.classes[program]
+                    break
+        if overrides:
+            limits = limits.merged(overrides, label or f"{limits.label}+intent")
+        return limits
+
+
+def load_limits(path=COMMAND_LIMITS_FILE):
+    """Load the limit policy; without a limits file only the environment defaults apply."""
+    if not os.path.exists(path):
+        return LimitPolicy()
+    return LimitPolicy.from_file(path)
@@ -0,0 +1,257 @@
+"""
+Streamed completions with early command extraction.
+
+The model answers with a small JSON object such as {"command": "ls -la"}.
+Instead of waiting for the whole completion, the response is streamed through
+an incremental parser that hands back the "command" value as soon as its
+closing quote arrives; the rest of the stream is dropped.
+
+With COMMAND_CANDIDATES > 1 the model is also asked for ranked "alternatives".
+The command is still handed back as soon as it is complete, while the
+alternatives keep streaming in the background, ready to be tried locally if
+the command fails.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+STREAM_COMPLETIONS = os.getenv("STREAM_COMPLETIONS", "1") == "1"
+COMMAND_MAX_TOKENS = int(os.getenv("COMMAND_MAX_TOKENS", 512))  # upper bound for one JSON command
+COMMAND_CANDIDATES = max(int(os.getenv("COMMAND_CANDIDATES", 1)), 1)  # >1 also asks for ranked fallbacks
+CANDIDATES_WAIT_SECONDS = float(os.getenv("CANDIDATES_WAIT_SECONDS", 5))
+
+
+class CommandExtractor:
+    """Incrementally scan streamed JSON text for the top-level "command" string."""
+
+    def __init__(self, key="command"):
+        self.key = key
+        self.text = ""
+        self.command = None
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string = []
+        self._pending_key = None
+        self._expect_value = False
+
+    def feed(self, delta: str):
+        """Consume a chunk of the response; return the command once it is complete."""
+        self.text += delta
+        if self.command is not None:
+            return self.command
+        for ch in delta:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    self._string.append(ch)
+                elif ch == "\\":
+                    self._escape = True
+                    self._string.append(ch)
+                elif ch == '"':
+                    self._in_string = False
+                    if self._close_string():
+                        return self.command
+                else:
+                    self._string.append(ch)
+            elif not self._started:
+                # Skip anything the model says before the JSON object starts
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+                self._string = []
+            elif ch == ":":
+                self._expect_value = self._pending_key == self.key and self._depth == 1
+                self._pending_key = None
+            elif ch in "{[":
+                self._depth += 1
+                self._expect_value = False
+            elif ch in "}]":
+                self._depth -= 1
+                self._expect_value = False
+            elif not ch.isspace():
+                self._pending_key = None
+                self._expect_value = False
+        return None
+
+    def _close_string(self) -> bool:
+        raw = "".join(self._string)
+        if self._expect_value:
+            self._expect_value = False
+            self.command = json.loads(f'"{raw}"')
+            return True
+        self._pending_key = raw
+        return False
+
+
+def _create_stream(client, messages, model, temperature, max_tokens):
+    # JSON mode cannot be combined with streaming; the system prompt already asks for JSON
+    return client.chat.completions.create(
+        messages=messages,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True
+    )
+
+
+def _deltas(stream):
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+def _read_command(stream, extractor) -> bool:
+    """Feed the stream into the extractor until the command is complete; False if it never was."""
+    for delta in _deltas(stream):
+        if extractor.feed(delta) is not None:
+            return True
+    return False
+
+
+def _close(stream):
+    # Drop the rest of the response instead of reading it to the end
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+
+def stream_command(client, messages, model, temperature, max_tokens=COMMAND_MAX_TOKENS):
+    """
+    Stream a completion and return (command, time_to_command, response_text)
+    as soon as the "command" value is complete; response_text is what was
+    received up to that point.
+
+    If the stream ends without one, the full text is parsed so callers see the
+    same json.JSONDecodeError / KeyError as with a buffered response.
+    """
+    start = time.perf_counter()
+    stream = _create_stream(client, messages, model, temperature, max_tokens)
+    extractor = CommandExtractor()
+    try:
+        _read_command(stream, extractor)
+    finally:
+        _close(stream)
+
+    command = extractor.command
+    if command is None:
+        command = json.loads(extractor.text)['command']
+    return command, time.perf_counter() - start, extractor.text
+
+
+def parse_alternatives(text, command, limit=COMMAND_CANDIDATES - 1):
+    """Ranked fallback commands from a complete answer, without repeats of the command itself."""
+    try:
+        alternatives = json.loads(text).get('alternatives')
+    except (json.JSONDecodeError, AttributeError):
+        return []
+    if not isinstance(alternatives, list):
+        return []
+    ranked = []
+    for alternative in alternatives:
+        if isinstance(alternative, str) and alternative.strip() and alternative != command and alternative not in ranked:
+            ranked.append(alternative)
+    return ranked[:limit]
+
+
+class Alternatives:
+    """Fallback commands for one answer; they may still be streaming in when the command runs."""
+
+    def __init__(self, alternatives=()):
+        self._alternatives = list(alternatives)
+        self._ready = threading.Event()
+        self._ready.set()
+
+    @classmethod
+    def from_stream(cls, stream, extractor, limit):
+        """Keep reading the rest of the stream in the background and parse it once it ends."""
+        pending = cls()
+        pending._ready.clear()
+
+        def drain():
+            try:
+                for delta in _deltas(stream):
+                    extractor.feed(delta)
+            except Exception as e:
+                logging.warning(f"Reading alternative commands failed: {e}")
+            finally:
+                _close(stream)
+                pending._alternatives = parse_alternatives(extractor.text, extractor.command, limit)
+                pending._ready.set()
+
+        threading.Thread(target=drain, daemon=True).start()
+        return pending
+
+    def get(self, timeout=CANDIDATES_WAIT_SECONDS):
+        """The ranked alternatives, or [] if they did not arrive in time."""
+        if not self._ready.wait(timeout):
+            logging.warning(f"Alternative commands did not arrive within {timeout}s")
+            return []
+        return list(self._alternatives)
+
+
+def stream_candidates(client, messages, model, temperature, max_tokens=COMMAND_MAX_TOKENS,
+                      limit=COMMAND_CANDIDATES - 1):
+    """
+    Like stream_command, but returns (command, time_to_command, response_text,
+    alternatives): the command as soon as it is complete, and an Alternatives
+    that fills in from the rest of the stream.
+    """
+    start = time.perf_counter()
+    stream = _create_stream(client, messages, model, temperature, max_tokens)
+    extractor = CommandExtractor()
+    try:
+        found = _read_command(stream, extractor)
+    except BaseException:
+        _close(stream)
+        raise
+    time_to_command = time.perf_counter() - start
+    text = extractor.text
+    if not found:
+        _close(stream)
+        command = json.loads(text)['command']
+        return command, time_to_command, text, Alternatives(parse_alternatives(text, command, limit))
+    return extractor.command, time_to_command, text, Alternatives.from_stream(stream, extractor, limit)
+
+
+class CandidateStats:
+    """How often trying a fallback candidate locally saved an LLM round-trip."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failures = 0  # first commands that failed
+        self.saved = 0  # ... and were fixed by a fallback candidate
+        self.exhausted = 0  # ... where every candidate failed too
+        self.unavailable = 0  # ... where the answer had no candidates
+        self.tried = 0
+
+    def record(self, tried, saved):
+        with self._lock:
+            self.failures += 1
+            self.tried += tried
+            if saved:
+                self.saved += 1
+            elif tried:
+                self.exhausted += 1
+            else:
+                self.unavailable += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'failures': self.failures,
+                'saved_round_trips': self.saved,
+                'exhausted': self.exhausted,
+                'no_candidates': self.unavailable,
+                'candidates_tried': self.tried,
+                'save_rate': round(self.saved / self.failures, 3) if self.failures else 0.0,
+            }
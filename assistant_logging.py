@@ -0,0 +1,89 @@
+"""
+Non-blocking, size-bounded logging.
+
+The REPL thread only puts records on a queue (QueueHandler); a background
+QueueListener thread formats them and writes them to a size-rotated log file.
+Rotated files are gzip-compressed, also in the background. Records are JSON
+objects, and structured fields can be attached with
+extra={'fields': {...}}. Long strings are cut to LOG_FIELD_LIMIT characters, so
+large command output never ends up in the log; callers log a preview and a
+reference to the history store instead.
+"""
+
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+
+LOG_FILE = os.getenv("LOG_FILE", "assistant.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 5 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_JSON = os.getenv("LOG_JSON", "1") == "1"
+LOG_FIELD_LIMIT = int(os.getenv("LOG_FIELD_LIMIT", 500))  # characters per logged string field
+LOG_MESSAGE_LIMIT = 4 * LOG_FIELD_LIMIT
+_TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def field_preview(text, limit=LOG_FIELD_LIMIT):
+    """Cheap bounded copy of a possibly huge string for a log field."""
+    if text is None or len(text) <= limit:
+        return text
+    return f"{text[:limit]}...[{len(text) - limit} chars cut]"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any extra 'fields'."""
+
+    def format(self, record):
+        data = {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': field_preview(record.getMessage(), LOG_MESSAGE_LIMIT),
+        }
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            data[key] = field_preview(value) if isinstance(value, str) else value
+        if record.exc_text:
+            data['exception'] = field_preview(record.exc_text, LOG_MESSAGE_LIMIT)
+        return json.dumps(data, default=str)
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def setup_logging(path=LOG_FILE, level=logging.INFO, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                  json_records=LOG_JSON):
+    """
+    Route the root logger through a queue to a rotating, compressing file
+    writer on a background thread, replacing any handlers already installed.
+    Returns the started listener; call its stop() at exit to flush what is
+    still queued.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                        delay=True)
+    file_handler.namer = _gzip_namer
+    file_handler.rotator = _gzip_rotator
+    file_handler.setFormatter(JsonFormatter() if json_records else logging.Formatter(_TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    return listener
@@ -0,0 +1,151 @@
+"""
+Latency-aware routing between a small, fast model and the large one.
+
+Short, single-step prompts ("what is my python version") go to the fast
+model; prompts that look like multi-step pipelines, and retries after a failed
+command, go to the large model (GROQ_MODEL). Routing is on for the groq backend, and
+for others once GROQ_FAST_MODEL names a model they serve. A rolling latency and success
+table per model drives the decision too: if the fast model's recent commands
+fail too often, everything is escalated, apart from an occasional probe that
+lets it recover.
+"""
+
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict, deque
+
+from assistant_backends import LLM_BACKEND
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "1") == "1"
+# The default fast model is a Groq one; other backends route only when it is set
+GROQ_FAST_MODEL = os.getenv("GROQ_FAST_MODEL", "llama-3.1-8b-instant" if LLM_BACKEND == "groq" else "")
+FAST_MODEL_MAX_WORDS = int(os.getenv("FAST_MODEL_MAX_WORDS", 12))
+FAST_MODEL_MIN_SUCCESS = float(os.getenv("FAST_MODEL_MIN_SUCCESS", 0.6))
+MODEL_STATS_WINDOW = 50
+_MIN_SAMPLES = 10  # outcomes needed before the success rate overrides the heuristics
+_MAX_PENDING = 256
+_PROBE_EVERY = 10  # while the fast model is escalated past, still send it every 10th simple prompt
+
+# Words that usually mean more than one step or a non-trivial command
+_COMPLEX_WORDS = re.compile(
+    r"\b(then|afterwards|pipe|each|every|recursively|replace|rename|convert|compress|archive|backup|"
+    r"schedule|cron|loop|script|install|unless|except|older than|newer than|larger than|bigger than|"
+    r"smaller than|between)\b"
+)
+_SHELL_CHARS = re.compile(r"[|;&<>$`]")
+
+
+def complexity_reason(user_prompt):
+    """Why a prompt needs the large model, or None if it looks simple."""
+    text = user_prompt.lower()
+    if len(text.split()) > FAST_MODEL_MAX_WORDS:
+        return "long prompt"
+    if _SHELL_CHARS.search(text):
+        return "shell syntax in prompt"
+    match = _COMPLEX_WORDS.search(text)
+    if match:
+        return f"multi-step wording ('{match.group(0)}')"
+    if text.count(" and ") + text.count(",") >= 2:
+        return "several clauses"
+    return None
+
+
+def _median(values):
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    return ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+
+
+class ModelStats:
+    """Rolling latency and command success of one model."""
+
+    __slots__ = ('latencies', 'outcomes', 'requests')
+
+    def __init__(self, window=MODEL_STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+
+    @property
+    def mean_latency(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else None
+
+    @property
+    def success_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else None
+
+    def summary(self):
+        return {
+            'requests': self.requests,
+            'p50_latency': round(_median(self.latencies), 3) if self.latencies else None,
+            'mean_latency': round(self.mean_latency, 3) if self.latencies else None,
+            'success_rate': round(self.success_rate, 3) if self.outcomes else None,
+            'outcomes': len(self.outcomes),
+        }
+
+
+class ModelRouter:
+    """Picks the model for each prompt and keeps per-model latency and success stats."""
+
+    def __init__(self, large_model, fast_model=GROQ_FAST_MODEL, enabled=MODEL_ROUTING):
+        self.large_model = large_model
+        self.fast_model = fast_model
+        self.enabled = enabled and bool(fast_model) and fast_model != large_model
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._pending = OrderedDict()  # user prompt -> model whose command has not run yet
+        self._skipped = 0
+
+    def _model_stats(self, model):
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    def choose(self, user_prompt, escalate=False):
+        """Return (model, reason) for a prompt; escalate=True always picks the large model."""
+        if not self.enabled:
+            model, reason = self.large_model, "routing off"
+        elif escalate:
+            model, reason = self.large_model, "escalated after a failed command"
+        else:
+            reason = complexity_reason(user_prompt)
+            with self._lock:
+                fast = self._model_stats(self.fast_model)
+                if reason is None and len(fast.outcomes) >= _MIN_SAMPLES and fast.success_rate < FAST_MODEL_MIN_SUCCESS:
+                    self._skipped += 1
+                    if self._skipped % _PROBE_EVERY:
+                        reason = f"fast model success rate {fast.success_rate:.0%}"
+            model, reason = (self.large_model, reason) if reason else (self.fast_model, "simple prompt")
+        with self._lock:
+            self._pending[user_prompt] = model
+            self._pending.move_to_end(user_prompt)
+            while len(self._pending) > _MAX_PENDING:
+                self._pending.popitem(last=False)
+        return model, reason
+
+    def record_latency(self, model, reason, latency):
+        """Add a request's latency to the table and log the decision with its estimated saving."""
+        with self._lock:
+            stats = self._model_stats(model)
+            stats.requests += 1
+            stats.latencies.append(latency)
+            large = self._stats.get(self.large_model)
+            large_mean = large.mean_latency if large is not None else None
+        saving = ""
+        if model == self.fast_model and large_mean is not None:
+            saving = f", {large_mean - latency:+.3f}s saved vs {self.large_model} mean"
+        logging.info(f"Model route: {model} ({reason}), latency={latency:.3f}s{saving}")
+
+    def record_outcome(self, user_prompt, success):
+        """Credit the model that produced the command for this prompt with its outcome."""
+        with self._lock:
+            model = self._pending.pop(user_prompt, None)
+            if model is not None:
+                self._model_stats(model).outcomes.append(bool(success))
+
+    def stats(self):
+        with self._lock:
+            return {model: stats.summary() for model, stats in self._stats.items()}
@@ -0,0 +1,122 @@
+"""
+In-process index of executables on PATH.
+
+Replaces forking `which` for every check: PATH is scanned once into a
+name -> path dict, and rescanned only when PATH itself or the mtime of one of
+its directories changes (checked at most every PATH_RECHECK_SECONDS).
+"""
+
+import os
+import sys
+import threading
+import time
+
+PATH_RECHECK_SECONDS = 2.0
+
+# Tools worth telling the model about when they are (or are not) available
+KNOWN_TOOLS = (
+    "git", "docker", "python3", "python", "pip", "node", "npm", "brew", "apt", "dnf", "pacman",
+    "curl", "wget", "jq", "rg", "fd", "fzf", "tree", "htop", "fortune", "cowsay", "say",
+    "xdg-open", "open", "pwsh", "zsh", "bash",
+)
+
+
+def _is_executable(entry):
+    try:
+        return entry.is_file() and os.access(entry.path, os.X_OK)
+    except OSError:
+        return False
+
+
+class ExecutableIndex:
+    """Name -> path map of everything runnable on PATH, first match wins like `which`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._dir_mtimes = {}
+        self._path_env = None
+        self._checked_at = 0.0
+
+    def _scan(self, path_env):
+        paths = {}
+        dir_mtimes = {}
+        extensions = [""]
+        if sys.platform == "win32":
+            extensions = [ext.lower() for ext in os.getenv("PATHEXT", ".EXE;.BAT;.CMD").split(";") if ext]
+        for directory in filter(None, path_env.split(os.pathsep)):
+            try:
+                dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+                entries = list(os.scandir(directory))
+            except OSError:
+                dir_mtimes[directory] = None
+                continue
+            for entry in entries:
+                name = entry.name
+                if sys.platform == "win32":
+                    stem, ext = os.path.splitext(name)
+                    if ext.lower() not in extensions:
+                        continue
+                    paths.setdefault(stem.lower(), entry.path)
+                    name = name.lower()
+                elif not _is_executable(entry):
+                    continue
+                paths.setdefault(name, entry.path)
+        self._paths = paths
+        self._dir_mtimes = dir_mtimes
+        self._path_env = path_env
+
+    def _is_stale(self, path_env):
+        if path_env != self._path_env:
+            return True
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                if mtime is not None:
+                    return True
+        return False
+
+    def _refresh(self):
+        now = time.monotonic()
+        path_env = os.getenv("PATH", "")
+        if self._path_env is not None and path_env == self._path_env and now - self._checked_at < PATH_RECHECK_SECONDS:
+            return
+        with self._lock:
+            if self._path_env is None or self._is_stale(path_env):
+                self._scan(path_env)
+            self._checked_at = now
+
+    def which(self, program):
+        """Return the full path of a program, or None if it is not on PATH."""
+        self._refresh()
+        if os.sep in program:
+            return program if os.access(program, os.X_OK) else None
+        return self._paths.get(program.lower() if sys.platform == "win32" else program)
+
+    def installed(self, program) -> bool:
+        return self.which(program) is not None
+
+    def which_many(self, programs):
+        """Return {program: path} for the given programs that exist on PATH."""
+        self._refresh()
+        found = {}
+        for program in programs:
+            path = self._paths.get(program.lower() if sys.platform == "win32" else program)
+            if path is not None:
+                found[program] = path
+        return found
+
+
+executable_index = ExecutableIndex()
+
+
+def check_program_installed(program: str) -> bool:
+    """Check if a particular program is installed and available."""
+    return executable_index.installed(program)
+
+
+def installed_tools(tools=KNOWN_TOOLS):
+    """Names of the given tools that are available, in the order given."""
+    return tuple(executable_index.which_many(tools))
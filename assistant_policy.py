@@ -0,0 +1,512 @@
+"""
+Command policy: allow, confirm or deny a command before it runs.
+
+A small shell lexer splits the command into simple commands: the parts of
+pipelines and &&, ||, ; lists, subshells, $(...), backticks and process
+substitutions, plus what wrappers run (sudo, env, xargs, timeout, ...), the
+script of 'sh -c', 'eval' and 'watch' and the command of 'find -exec'. Output
+redirections to files are checked as writes, under the program name '>'.
+
+Each simple command is matched against the rules of COMMAND_POLICY_FILE in
+file order; the first rule that matches its program gives its action, the
+default action applies when none does. The command's verdict is the strictest
+one: deny over confirm over allow. The rules are compiled into a per-program
+table when the policy loads, and verdicts are memoized per command, so a
+repeated command costs a dict lookup.
+
+Rule keys: name, action, programs (names or globs), and optionally flags
+(any of them given; short flags also match inside clusters like -rf), args
+(globs, any positional argument matches), subcommands (first positional
+argument, e.g. git push), piped (true: stdin comes from a pipe) and reason.
+"""
+
+import fnmatch
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+COMMAND_POLICY = os.getenv("COMMAND_POLICY", "1") == "1"
+COMMAND_POLICY_FILE = os.getenv("COMMAND_POLICY_FILE",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "command_policy.json"))
+POLICY_CACHE_SIZE = int(os.getenv("POLICY_CACHE_SIZE", 4096))  # memoized verdicts
+
+ALLOW, CONFIRM, DENY = "allow", "confirm", "deny"
+_SEVERITY = {ALLOW: 0, CONFIRM: 1, DENY: 2}
+_RULE_KEYS = {'name', 'action', 'programs', 'flags', 'args', 'subcommands', 'piped', 'reason'}
+_MAX_DEPTH = 8  # nested substitutions, wrappers and 'sh -c' scripts
+
+# Longest first, so '&&' is not read as two '&'
+_OPERATORS = ("&&", "||", ";;", "|&", "|", ";", "&", "\n")
+_REDIRECT = re.compile(r"(?:\d+|&)?(?:>>|>&|>\||<<<|<<-|<<|<>|<&|>|<)")
+_WORD_END = frozenset(" \t\n;&|()<>")
+_WORD_SPECIAL = _WORD_END | frozenset("'\"\\`$")
+_BLANKS = re.compile(r"[ \t]+")
+_ASSIGNMENT = re.compile(r"^\w+(\[[^\]]*\])?\+?=")
+_SHORT_FLAG = re.compile(r"^-[A-Za-z0-9]$")
+_SHORT_CLUSTER = re.compile(r"^-[A-Za-z0-9]+$")
+# Words that can come before the program of a simple command
+_KEYWORDS = {"!", "{", "}", "if", "then", "else", "elif", "fi", "do", "done", "while", "until", "esac"}
+# Programs that run another command given in their arguments, with their options that take a value
+_WRAPPERS = {
+    "sudo": {"-u", "-g", "-p", "-C", "-h", "-U", "-r", "-t", "-D"},
+    "doas": {"-u", "-C"},
+    "env": {"-u", "-C", "-S"},
+    "nice": {"-n"},
+    "ionice": {"-c", "-n", "-p"},
+    "nohup": set(),
+    "time": {"-f", "-o"},
+    "command": set(),
+    "builtin": set(),
+    "exec": {"-a"},
+    "timeout": {"-s", "-k"},
+    "stdbuf": {"-i", "-o", "-e"},
+    "xargs": {"-I", "-n", "-P", "-d", "-L", "-s", "-E", "-a"},
+    "chroot": set(),
+    "watch": {"-n"},
+}
+_WRAPPER_POSITIONALS = {"timeout": 1, "chroot": 1}  # e.g. the duration of 'timeout 5 cmd'
+_SHELLS = {"sh", "bash", "zsh", "dash", "ksh"}
+_FIND_EXEC = {"-exec", "-execdir", "-ok", "-okdir"}
+
+
+class SimpleCommand:
+    """One simple command: its words with quotes removed and the files it redirects output to."""
+
+    __slots__ = ('argv', 'writes', 'piped')
+
+    def __init__(self, argv, writes, piped):
+        self.argv = argv
+        self.writes = writes
+        self.piped = piped  # stdin comes from a pipe
+
+    def __repr__(self):
+        return f"SimpleCommand({self.argv}, writes={self.writes}, piped={self.piped})"
+
+
+class _Parser:
+    """Recursive descent over the shell grammar, far enough to find every simple command."""
+
+    def __init__(self, text, depth=0):
+        self.s = text
+        self.depth = depth
+        self.commands = []
+
+    def parse(self):
+        self._list(0, None)
+        return self.commands
+
+    def _emit(self, argv, writes, piped):
+        if argv or writes:
+            self.commands.append(SimpleCommand(argv, writes, piped))
+
+    def _nested(self, i, closer):
+        if self.depth >= _MAX_DEPTH:
+            raise ValueError("nested too deeply")
+        self.depth += 1
+        try:
+            return self._list(i, closer)
+        finally:
+            self.depth -= 1
+
+    def _list(self, i, closer):
+        s, n = self.s, len(self.s)
+        argv, writes, piped, heredocs = [], [], False, []
+        while i < n:
+            c = s[i]
+            if c in " \t":
+                i += 1
+                continue
+            if s.startswith("\\\n", i):
+                i += 2
+                continue
+            if c == "#":
+                end = s.find("\n", i)
+                i = n if end < 0 else end
+                continue
+            if c in "<>" and s.startswith("(", i + 1):
+                i = self._nested(i + 2, ")")  # process substitution
+                continue
+            match = _REDIRECT.match(s, i)
+            if match:
+                op = match.group().lstrip("0123456789&")
+                i = match.end()
+                while i < n and s[i] in " \t":
+                    i += 1
+                target, i = self._word(i)
+                if target is None:
+                    raise ValueError(f"missing target after '{match.group()}'")
+                if op in ("<<", "<<-"):
+                    heredocs.append((target, op == "<<-"))
+                elif op in (">", ">>", ">|", "<>") or (op == ">&" and not target.isdigit() and target != "-"):
+                    writes.append(target)
+                continue
+            if c == ")":
+                if closer != ")":
+                    raise ValueError("unbalanced ')'")
+                self._emit(argv, writes, piped)
+                return i + 1
+            if c == "(":
+                i = self._nested(i + 1, ")")  # subshell, or the () of a function definition
+                continue
+            op = next((op for op in _OPERATORS if s.startswith(op, i)), None)
+            if op is not None:
+                self._emit(argv, writes, piped)
+                argv, writes, piped = [], [], op in ("|", "|&")
+                i += len(op)
+                if op == "\n" and heredocs:
+                    i = self._skip_heredocs(i, heredocs)
+                    heredocs = []
+                continue
+            word, i = self._word(i)
+            argv.append(word)
+        if closer is not None:
+            raise ValueError(f"missing '{closer}'")
+        self._emit(argv, writes, piped)
+        return i
+
+    def _skip_heredocs(self, i, heredocs):
+        s, n = self.s, len(self.s)
+        for delimiter, strip_tabs in heredocs:
+            while i < n:
+                end = s.find("\n", i)
+                end = n if end < 0 else end
+                line = s[i:end]
+                i = end + 1
+                if (line.lstrip("\t") if strip_tabs else line) == delimiter:
+                    break
+        return min(i, n)
+
+    def _word(self, i):
+        """(word with quotes removed, index after it), or (None, i) if no word starts at i."""
+        s, n = self.s, len(self.s)
+        start, parts = i, []
+        while i < n:
+            c = s[i]
+            if c in _WORD_END:
+                break
+            if c == "'":
+                end = s.find("'", i + 1)
+                if end < 0:
+                    raise ValueError("unterminated single quote")
+                parts.append(s[i + 1:end])
+                i = end + 1
+            elif c == '"':
+                i = self._double_quoted(i + 1, parts)
+            elif c == "\\":
+                if i + 1 < n and s[i + 1] != "\n":
+                    parts.append(s[i + 1])
+                i += 2
+            elif c == "`":
+                i = self._backticks(i + 1, parts)
+            elif c == "$" and s.startswith("$(", i):
+                i = self._substitution(i, parts)
+            elif c == "$" and s.startswith("${", i):
+                end = s.find("}", i)
+                if end < 0:
+                    raise ValueError("unterminated '${'")
+                parts.append(s[i:end + 1])
+                i = end + 1
+            else:
+                end = i + 1
+                while end < n and s[end] not in _WORD_SPECIAL:
+                    end += 1
+                parts.append(s[i:end])
+                i = end
+        if i == start:
+            return None, i
+        return "".join(parts), i
+
+    def _double_quoted(self, i, parts):
+        s, n = self.s, len(self.s)
+        while i < n:
+            c = s[i]
+            if c == '"':
+                return i + 1
+            if c == "\\" and i + 1 < n:
+                parts.append(s[i + 1] if s[i + 1] in '$`"\\' else s[i:i + 2])
+                i += 2
+            elif c == "`":
+                i = self._backticks(i + 1, parts)
+            elif c == "$" and s.startswith("$(", i):
+                i = self._substitution(i, parts)
+            else:
+                end = i + 1
+                while end < n and s[end] not in '"\\`$':
+                    end += 1
+                parts.append(s[i:end])
+                i = end
+        raise ValueError("unterminated double quote")
+
+    def _substitution(self, i, parts):
+        s = self.s
+        if s.startswith("$((", i):
+            # Arithmetic: no commands inside
+            depth, end = 0, i + 1
+            while end < len(s):
+                depth += {"(": 1, ")": -1}.get(s[end], 0)
+                end += 1
+                if depth == 0:
+                    break
+            else:
+                raise ValueError("unterminated '$(('")
+        else:
+            end = self._nested(i + 2, ")")
+        parts.append(s[i:end])
+        return end
+
+    def _backticks(self, i, parts):
+        s, n = self.s, len(self.s)
+        end = i
+        while end < n and s[end] != "`":
+            end += 2 if s[end] == "\\" else 1
+        if end >= n:
+            raise ValueError("unterminated backquote")
+        if self.depth >= _MAX_DEPTH:
+            raise ValueError("nested too deeply")
+        self.commands.extend(_Parser(s[i:end].replace("\\`", "`"), self.depth + 1).parse())
+        parts.append(s[i - 1:end + 1])
+        return end + 1
+
+
+def split_commands(command):
+    """The simple commands of a shell command line; raises ValueError if it cannot be parsed."""
+    return _Parser(command).parse()
+
+
+def _unwrap(program, args):
+    """The command a wrapper runs, e.g. ['rm', 'x'] for 'sudo -u root rm x'."""
+    value_options = _WRAPPERS[program]
+    positionals = _WRAPPER_POSITIONALS.get(program, 0)
+    i = 0
+    while i < len(args):
+        word = args[i]
+        if word == "--":
+            i += 1
+            break
+        if word.startswith("-") and len(word) > 1:
+            i += 2 if word in value_options else 1
+        elif program == "env" and "=" in word:
+            i += 1
+        elif positionals:
+            positionals -= 1
+            i += 1
+        else:
+            break
+    return args[i:]
+
+
+def _find_exec_commands(args):
+    """The commands of find's -exec, -execdir, -ok and -okdir actions."""
+    commands, i = [], 0
+    while i < len(args):
+        if args[i] in _FIND_EXEC:
+            end = i + 1
+            while end < len(args) and args[end] not in (";", "+"):
+                end += 1
+            commands.append(args[i + 1:end])
+            i = end
+        i += 1
+    return commands
+
+
+class PolicyRule:
+    """One compiled rule: which invocations it matches and the action it gives them."""
+
+    __slots__ = ('name', 'action', 'programs', 'program_re', 'long_flags', 'short_flags', 'args_re', 'subcommands',
+                 'piped', 'reason')
+
+    def __init__(self, name, action, programs, flags=(), args=(), subcommands=(), piped=None, reason=None):
+        if action not in _SEVERITY:
+            raise ValueError(f"Unknown action '{action}' in command policy rule '{name}'.")
+        self.name = name
+        self.action = action
+        self.programs = frozenset(p for p in programs if not any(ch in p for ch in "*?["))
+        globs = [fnmatch.translate(p) for p in programs if any(ch in p for ch in "*?[")]
+        self.program_re = re.compile("|".join(globs)) if globs else None
+        self.long_flags = frozenset(f for f in flags if not _SHORT_FLAG.match(f))
+        self.short_flags = frozenset(f[1] for f in flags if _SHORT_FLAG.match(f))
+        self.args_re = re.compile("|".join(fnmatch.translate(p) for p in args)) if args else None
+        self.subcommands = frozenset(subcommands)
+        self.piped = piped
+        self.reason = reason
+
+    @classmethod
+    def from_dict(cls, data, index):
+        name = data.get('name', f"rule {index + 1}")
+        unknown = set(data) - _RULE_KEYS
+        if unknown:
+            raise ValueError(f"Unknown key(s) {', '.join(sorted(unknown))} in command policy rule '{name}'.")
+        return cls(name, data.get('action', CONFIRM), data.get('programs', []), data.get('flags', ()),
+                   data.get('args', ()), data.get('subcommands', ()), data.get('piped'), data.get('reason'))
+
+    def applies_to(self, program):
+        return program in self.programs or (self.program_re is not None and self.program_re.match(program) is not None)
+
+    def matches(self, args, piped):
+        """Whether the rule's conditions hold for a program's arguments."""
+        if self.piped is not None and piped != self.piped:
+            return False
+        flagged = not (self.long_flags or self.short_flags)
+        positional, options_done = [], False
+        for word in args:
+            if options_done or not word.startswith("-") or word == "-":
+                positional.append(word)
+            elif word == "--":
+                options_done = True
+            elif not flagged:
+                flagged = (word in self.long_flags or word.split("=", 1)[0] in self.long_flags
+                           or (bool(self.short_flags) and _SHORT_CLUSTER.match(word) is not None
+                               and not self.short_flags.isdisjoint(word[1:])))
+        if not flagged:
+            return False
+        if self.subcommands:
+            if not positional or positional[0] not in self.subcommands:
+                return False
+            positional = positional[1:]
+        if self.args_re is None:
+            return True
+        # '/usr/' names the same directory as '/usr'
+        return any(self.args_re.match(word) or self.args_re.match(word.rstrip("/") or "/") for word in positional)
+
+
+class Verdict:
+    """What to do with a command, and the rule and invocation that decided it."""
+
+    __slots__ = ('action', 'rule', 'reason')
+
+    def __init__(self, action, rule=None, reason=None):
+        self.action = action
+        self.rule = rule
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Verdict({self.action!r}, rule={self.rule!r}, reason={self.reason!r})"
+
+
+class CommandPolicy:
+    """Compiled rules plus a memo of verdicts per normalized command."""
+
+    def __init__(self, rules=(), default=ALLOW, unparsable=CONFIRM, cache_size=POLICY_CACHE_SIZE):
+        for action in (default, unparsable):
+            if action not in _SEVERITY:
+                raise ValueError(f"Unknown command policy action '{action}'.")
+        self.rules = list(rules)
+        self.default = default
+        self.unparsable = unparsable
+        self.cache_size = cache_size
+        # program -> its rules in file order; programs named only by globs are added on first use
+        self._table = {}
+        for rule in self.rules:
+            for program in rule.programs:
+                self._table.setdefault(program, None)
+        self._glob_rules = [rule for rule in self.rules if rule.program_re is not None]
+        for program in list(self._table):
+            self._table[program] = [rule for rule in self.rules if rule.applies_to(program)]
+        self._allowed = Verdict(ALLOW)
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_file(cls, path=COMMAND_POLICY_FILE):
+        with open(path, "r") as f:
+            data = json.load(f)
+        rules = [PolicyRule.from_dict(rule, i) for i, rule in enumerate(data.get('rules', []))]
+        return cls(rules, data.get('default', ALLOW), data.get('unparsable', CONFIRM))
+
+    def _rules_for(self, program):
+        rules = self._table.get(program)
+        if rules is None:
+            rules = [rule for rule in self._glob_rules if rule.applies_to(program)]
+            if len(self._table) < self.cache_size:
+                self._table[program] = rules
+        return rules
+
+    def _judge(self, program, args, piped):
+        for rule in self._rules_for(program):
+            if rule.matches(args, piped):
+                if rule.action == ALLOW:
+                    return self._allowed
+                invocation = " ".join([program, *args])
+                invocation = invocation if len(invocation) <= 80 else invocation[:77] + "..."
+                return Verdict(rule.action, rule.name, f"{rule.reason or rule.name}: {invocation}")
+        if self.default == ALLOW:
+            return self._allowed
+        return Verdict(self.default, None, f"'{program}' is not covered by the command policy")
+
+    def _invocations(self, argv, piped, depth):
+        """(program, args, piped) for a simple command and every command it runs in turn."""
+        i = 0
+        while i < len(argv) and (argv[i] in _KEYWORDS or _ASSIGNMENT.match(argv[i])):
+            i += 1
+        if i == len(argv):
+            return
+        program, args = os.path.basename(argv[i]), argv[i + 1:]
+        yield program, args, piped
+        if depth >= _MAX_DEPTH:
+            raise ValueError("nested too deeply")
+        if program == "watch":
+            # Runs its arguments through sh -c
+            yield from self._script_invocations(" ".join(_unwrap(program, args)), depth + 1)
+        elif program in _WRAPPERS:
+            yield from self._invocations(_unwrap(program, args), piped, depth + 1)
+        elif program in _SHELLS and "-c" in args[:-1]:
+            yield from self._script_invocations(args[args.index("-c") + 1], depth + 1)
+        elif program == "eval":
+            yield from self._script_invocations(" ".join(args), depth + 1)
+        elif program == "find":
+            for inner in _find_exec_commands(args):
+                yield from self._invocations(inner, False, depth + 1)
+
+    def _script_invocations(self, script, depth):
+        for simple in _Parser(script, depth).parse():
+            yield from self._invocations(simple.argv, simple.piped, depth)
+            for target in simple.writes:
+                yield ">", [target], False
+
+    def evaluate(self, command):
+        """The verdict for a command, without the memo."""
+        worst = self._allowed
+        try:
+            for program, args, piped in self._script_invocations(command, 0):
+                verdict = self._judge(program, args, piped)
+                if _SEVERITY[verdict.action] > _SEVERITY[worst.action]:
+                    worst = verdict
+                    if worst.action == DENY:
+                        break
+        except ValueError as e:
+            return Verdict(self.unparsable, None, f"could not parse the command: {e}")
+        return worst
+
+    def check(self, command):
+        """The verdict for a command, memoized per command with runs of blanks collapsed."""
+        key = _BLANKS.sub(" ", command.strip())
+        with self._lock:
+            verdict = self._memo.get(key)
+            if verdict is not None:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return verdict
+        # The normalized text is what gets judged, so every command sharing the key gets its verdict
+        verdict = self.evaluate(key)
+        with self._lock:
+            self.misses += 1
+            self._memo[key] = verdict
+            while len(self._memo) > self.cache_size:
+                self._memo.popitem(last=False)
+        return verdict
+
+    def stats(self):
+        with self._lock:
+            return {'rules': len(self.rules), 'cached_verdicts': len(self._memo), 'hits': self.hits,
+                    'misses': self.misses}
+
+
+def load_policy(path=COMMAND_POLICY_FILE):
+    """Load the command policy; without a policy file every command is allowed."""
+    if not os.path.exists(path):
+        return CommandPolicy()
+    return CommandPolicy.from_file(path)
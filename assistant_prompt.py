@@ -0,0 +1,170 @@
+"""
+System prompt assembly and token budgeting for LLM requests.
+
+The static part of the system prompt (instructions, shell, OS, open command,
+browser) is rendered once per session and never changes, so every request
+starts with a byte-identical prefix that providers can cache. Only the recent
+history is appended at the end.
+
+Token counts are estimated locally (no tokenizer dependency) and used to keep
+the history part of the system prompt within a configurable input budget and
+to size max_tokens to the small JSON answer we expect back.
+"""
+
+import json
+import math
+import os
+from functools import lru_cache
+
+from assistant_llm import COMMAND_CANDIDATES, COMMAND_MAX_TOKENS
+from assistant_path import installed_tools
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1500))  # whole system prompt
+HISTORY_FIELD_TOKENS = int(os.getenv("HISTORY_FIELD_TOKENS", 80))  # per command/error field
+RETRY_ERROR_TOKENS = int(os.getenv("RETRY_ERROR_TOKENS", 200))
+ANSWER_MIN_TOKENS = 160
+CHARS_PER_TOKEN = 3.5  # conservative for shell-heavy English text
+_ANSWER_OVERHEAD_TOKENS = 16  # {"command": ""} plus end-of-answer slack
+
+PLATFORM_INFO = {
+    "macos": {
+        "open_command": "open",
+        "browser": "Safari"
+    },
+    "linux": {
+        "open_command": "xdg-open",
+        "browser": "firefox"
+    },
+    "windows": {
+        "open_command": "start",
+        "browser": "Microsoft Edge"
+    }
+}
+
+_STATIC_PROMPT = """You are an AI assistant that understands natural language prompts and generates the most appropriate shell commands to execute based on the user's request. Your task is to analyze the user's input and determine the best command to execute, then provide the command in a valid JSON format with a "command" key.
+
+Environment Information:
+- Shell: {shell_name}
+- Operating System: {operating_system}
+- Open Command: {open_command}
+- Default Browser: {browser}
+- Installed Tools: {tools}
+
+When the user asks for a complex task, respond with a single command line using pipes (`|`), logical operators (`&&`, `||`), and redirections (`>`, `>>`, `<`). Your goal is to provide the most appropriate command for the user's request.
+
+For example:
+- If the user says "Install and start Apache," respond with:
+  {{"command": "sudo apt update && sudo apt install -y apache2 && sudo systemctl start apache2"}}
+- If the user says "Partition and format USB," respond with:
+  {{"command": "usb=/dev/sdX && sudo fdisk $usb <<< $(printf 'n\\np\\n\\n\\n\\nw') && sudo mkfs.ext4 ${{usb}}1"}}
+
+Please be concise and only provide the necessary command, without any additional explanation or context. Your goal is to provide the most appropriate command for the user's request.
+"""
+
+_CANDIDATES_PROMPT = """
+After the "command" key, also include an "alternatives" key with a list of up to {count} other commands that would satisfy the request, best first. They are tried in order if the main command fails, so prefer ones that work around likely failures (missing tools, different flags or paths), for example:
+  {{"command": "python --version", "alternatives": ["python3 --version"]}}
+"""
+
+
+def estimate_tokens(text) -> int:
+    """Rough token count of a string; errs on the high side."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Shorten text to about max_tokens, keeping its start and end."""
+    if text is None or estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max(int(max_tokens * CHARS_PER_TOKEN) - 20, 0)
+    head = keep * 2 // 3
+    tail = keep - head
+    omitted = len(text) - head - tail
+    return f"{text[:head]} ...[{omitted} chars cut]... {text[len(text) - tail:] if tail else ''}".rstrip()
+
+
+@lru_cache(maxsize=256)
+def _history_line(command, success, error, field_tokens):
+    """Render one history entry; memoized since the same entries recur in consecutive prompts."""
+    line = (f"Previous Command: {truncate_to_tokens(command, field_tokens)}, Success: {success}, "
+            f"Error: {truncate_to_tokens(error, field_tokens) or 'None'}")
+    return line, estimate_tokens(line) + 1
+
+
+def history_lines(records, budget_tokens, field_tokens=HISTORY_FIELD_TOKENS):
+    """
+    Render history records as prompt lines within a token budget.
+
+    Each field is capped at field_tokens; if the lines still do not fit, the
+    oldest records are dropped first.
+    """
+    lines = []
+    used = 0
+    for h in reversed(records):
+        line, cost = _history_line(h.command, h.success, h.error, field_tokens)
+        if used + cost > budget_tokens:
+            break
+        lines.append(line)
+        used += cost
+    lines.reverse()
+    return lines
+
+
+def answer_max_tokens(records=(), candidates=COMMAND_CANDIDATES):
+    """
+    max_tokens for a {"command": ...} answer: room for twice the longest recent
+    command, within [ANSWER_MIN_TOKENS, COMMAND_MAX_TOKENS], per requested candidate.
+    """
+    longest = max((estimate_tokens(h.command) for h in records), default=0)
+    return candidates * min(max(ANSWER_MIN_TOKENS, 2 * longest + _ANSWER_OVERHEAD_TOKENS), COMMAND_MAX_TOKENS)
+
+
+@lru_cache(maxsize=None)
+def static_prompt(shell_name, operating_system):
+    """Render the session-constant prefix of the system prompt (once per environment)."""
+    platform_data = PLATFORM_INFO.get(operating_system, {})
+    prompt = _STATIC_PROMPT.format(
+        shell_name=shell_name,
+        operating_system=operating_system,
+        open_command=platform_data.get("open_command", "unknown"),
+        browser=platform_data.get("browser", "unknown"),
+        tools=", ".join(installed_tools()) or "unknown",
+    )
+    if COMMAND_CANDIDATES > 1:
+        prompt += _CANDIDATES_PROMPT.format(count=COMMAND_CANDIDATES - 1)
+    return prompt
+
+
+def example_lines(examples, budget_tokens, field_tokens=HISTORY_FIELD_TOKENS):
+    """Render (score, prompt, command) few-shot examples within a token budget, best first."""
+    lines = []
+    used = 0
+    for _, prompt, command in examples:
+        answer = json.dumps({"command": truncate_to_tokens(command, field_tokens)})
+        line = f"- \"{truncate_to_tokens(prompt, field_tokens)}\" -> {answer}"
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget_tokens:
+            break
+        lines.append(line)
+        used += cost
+    return lines
+
+
+def build_system_prompt(shell_name, operating_system, records, examples=()):
+    """
+    Static prefix followed by as much recent history, then as many similar
+    past successes, as the token budget allows.
+    """
+    prefix = static_prompt(shell_name, operating_system)
+    budget = PROMPT_TOKEN_BUDGET - estimate_tokens(prefix)
+    lines = history_lines(records, budget)
+    prompt = prefix
+    if lines:
+        prompt += "\nRecent commands:\n" + "\n".join(lines) + "\n"
+        budget -= sum(estimate_tokens(line) + 1 for line in lines)
+    examples = example_lines(examples, budget)
+    if examples:
+        prompt += "\nSimilar requests that worked before:\n" + "\n".join(examples) + "\n"
+    return prompt
@@ -0,0 +1,148 @@
+"""
+Retrieval of past successful commands as few-shot context.
+
+Each distinct prompt that led to a successful command is embedded locally with
+hashed TF-IDF features (words, word bigrams and character trigrams, no model
+download or network) into a fixed-size vector. Lookups are one NumPy
+matrix-vector product over all stored vectors plus a partial sort, which keeps
+retrieval within a few milliseconds at 100k entries.
+
+NumPy is optional: without it retrieval is simply switched off.
+"""
+
+import math
+import os
+import re
+import threading
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # few-shot retrieval is optional
+    np = None
+
+RETRIEVAL_ENABLED = os.getenv("FEW_SHOT_RETRIEVAL", "1") == "1" and np is not None
+RETRIEVAL_DIM = int(os.getenv("RETRIEVAL_DIM", 128))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 3))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", 0.5))
+_IDF_REFRESH_GROWTH = 1.1  # reweight stored vectors once the corpus grew by 10%
+
+
+def _features(text):
+    words = re.findall(r"[\w.~/-]+", text.lower())
+    feats = list(words)
+    feats += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        feats += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    return feats
+
+
+def hashed_counts(text, dim=RETRIEVAL_DIM):
+    """Signed feature-hashing of a text: {bucket: signed count}."""
+    counts = {}
+    for feature in _features(text):
+        h = zlib.crc32(feature.encode())
+        bucket = h % dim
+        counts[bucket] = counts.get(bucket, 0) + (1 if h & 0x80000000 else -1)
+    return counts
+
+
+class RetrievalIndex:
+    """Hashed TF-IDF vectors of successful prompts with brute-force cosine search."""
+
+    def __init__(self, dim=RETRIEVAL_DIM):
+        if np is None:
+            raise RuntimeError("Few-shot retrieval needs NumPy.")
+        self.dim = dim
+        self._tf = np.zeros((1024, dim), dtype=np.float16)  # raw term weights, kept to re-apply IDF
+        self._matrix = np.zeros((1024, dim), dtype=np.float32)
+        self._df = np.zeros(dim, dtype=np.float64)
+        self._idf = np.ones(dim, dtype=np.float32)
+        self._idf_docs = 0
+        self._n = 0
+        self._doc_ids = {}
+        self._prompts = []
+        self._commands = []
+        self.last_history_id = 0
+        self._write_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return self._n
+
+    def _tf_vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for bucket, count in hashed_counts(text, self.dim).items():
+            if count:
+                vector[bucket] = math.copysign(1 + math.log(abs(count)), count)
+        return vector
+
+    def _weigh(self, tf):
+        weighted = tf * self._idf
+        norms = np.linalg.norm(weighted, axis=-1, keepdims=True)
+        return weighted / np.maximum(norms, 1e-9)
+
+    def _reweigh_all(self):
+        n = self._n
+        self._idf = (np.log((n + 1) / (self._df + 1)) + 1).astype(np.float32)
+        matrix = np.zeros(self._tf.shape, dtype=np.float32)
+        matrix[:n] = self._weigh(self._tf[:n].astype(np.float32))
+        self._matrix = matrix
+        self._idf_docs = n
+
+    def add(self, user_prompt, command, success):
+        """Index a successful command; failures are never offered as examples."""
+        with self._write_lock:
+            if not success or not user_prompt or not command:
+                return
+            key = " ".join(user_prompt.lower().split())
+            doc_id = self._doc_ids.get(key)
+            if doc_id is not None:
+                self._commands[doc_id] = command
+                return
+
+            tf = self._tf_vector(user_prompt)
+            n = self._n
+            if n == len(self._tf):
+                self._tf = np.concatenate([self._tf, np.zeros_like(self._tf)])
+                self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+            self._tf[n] = tf
+            self._df += tf != 0
+            self._prompts.append(user_prompt)
+            self._commands.append(command)
+            self._doc_ids[key] = n
+            if n + 1 >= max(self._idf_docs * _IDF_REFRESH_GROWTH, 64):
+                self._n = n + 1
+                self._reweigh_all()
+            else:
+                self._matrix[n] = self._weigh(tf)
+                self._n = n + 1
+
+    def refresh(self, store):
+        """
+        Index entries written to the store since the last refresh; no-op if one is running.
+        As in TrigramIndex.refresh, only this advances last_history_id.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            for history_id, user_prompt, command, success in store.prompts_since(self.last_history_id):
+                self.add(user_prompt, command, success)
+                self.last_history_id = history_id
+        finally:
+            self._refresh_lock.release()
+
+    def search(self, user_prompt, k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """Return up to k (score, prompt, command) tuples for similar successful prompts, best first."""
+        matrix, n = self._matrix, self._n
+        if n == 0 or k <= 0:
+            return []
+        query = self._weigh(self._tf_vector(user_prompt))
+        scores = matrix[:n] @ query
+        # Thresholding first leaves only a handful of candidates to sort
+        candidates = np.flatnonzero(scores >= min_score)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], len(candidates) - k)[-k:]]
+        candidates = candidates[np.argsort(scores[candidates])[::-1]]
+        return [(round(float(scores[i]), 3), self._prompts[i], self._commands[i]) for i in candidates]
@@ -0,0 +1,179 @@
+"""
+Compiled local intent router.
+
+Known intents are loaded from a JSON data file and compiled into a word trie
+with parameter slots, e.g. "use cowsay with {text}" -> "cowsay {text}". A
+query is matched in one walk over its words, anchored at both ends, so the
+cost does not grow with the number of intents and "try" never matches inside
+"entry" or "retry". Matches are answered locally; anything else falls
+through to the LLM.
+"""
+
+import json
+import os
+import re
+import shlex
+from urllib.parse import quote_plus
+
+from assistant_path import check_program_installed
+
+LOCAL_INTENTS = os.getenv("LOCAL_INTENTS", "1") == "1"
+INTENTS_FILE = os.getenv("INTENTS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents.json"))
+# macOS-only intents with catch-all patterns; only the improvement_added_3 demo loads them
+MACOS_INTENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents_macos.json")
+
+_STRIP_CHARS = "?!.,;:\"'`()"
+_PLACEHOLDER = re.compile(r"\{(\w+)(?::(\w+))?\}")
+_SLOT = re.compile(r"^\{(\w+)\}$")
+_FILTERS = {
+    None: shlex.quote,
+    "url": quote_plus,
+    "raw": str,
+}
+
+
+def _normalize_word(word):
+    return word.lower().replace("’", "'").strip(_STRIP_CHARS)
+
+
+def _unquote(value):
+    value = value.strip().rstrip("?!")
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
+
+
+class Intent:
+    """One pattern and what to do when it matches: run a command or show a message."""
+
+    __slots__ = ('pattern', 'command', 'message', 'requires', 'missing_message', 'limits')
+
+    def __init__(self, pattern, command=None, message=None, requires=(), missing_message=None, limits=None):
+        if not command and not message:
+            raise ValueError(f"Intent '{pattern}' needs a command or a message.")
+        self.pattern = pattern
+        self.command = command
+        self.message = message
+        self.requires = tuple(requires)
+        self.missing_message = missing_message
+        self.limits = limits  # command limit overrides, see assistant_limits
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['pattern'], data.get('command'), data.get('message'),
+                   data.get('requires', ()), data.get('missing_message'), data.get('limits'))
+
+
+class IntentMatch:
+    """A matched intent with its slot values bound."""
+
+    __slots__ = ('intent', 'slots')
+
+    def __init__(self, intent, slots):
+        self.intent = intent
+        self.slots = slots
+
+    @property
+    def missing_programs(self):
+        return [program for program in self.intent.requires if not check_program_installed(program)]
+
+    @property
+    def message(self):
+        """Text to show instead of running anything, or None."""
+        if self.intent.message:
+            return self.intent.message
+        missing = self.missing_programs
+        if missing:
+            return self.intent.missing_message or f"Please install {', '.join(missing)} to use this feature."
+        return None
+
+    @property
+    def command(self):
+        """The intent's command with slot values quoted for the shell."""
+        if not self.intent.command:
+            return None
+        return _PLACEHOLDER.sub(lambda m: _FILTERS[m.group(2)](self.slots[m.group(1)]), self.intent.command)
+
+
+class _Node:
+    __slots__ = ('children', 'slot_name', 'slot_node', 'intent')
+
+    def __init__(self):
+        self.children = {}
+        self.slot_name = None
+        self.slot_node = None
+        self.intent = None
+
+
+class IntentRouter:
+    """Word trie of intent patterns; a slot matches one or more words."""
+
+    def __init__(self, intents=()):
+        self._root = _Node()
+        self.size = 0
+        for intent in intents:
+            self.add(intent)
+
+    @classmethod
+    def from_file(cls, *paths):
+        """Build a router from one or more intent files (default: INTENTS_FILE)."""
+        intents = []
+        for path in paths or (INTENTS_FILE,):
+            with open(path, "r") as f:
+                intents.extend(Intent.from_dict(data) for data in json.load(f))
+        return cls(intents)
+
+    def add(self, intent):
+        node = self._root
+        for word in intent.pattern.split():
+            slot = _SLOT.match(word)
+            if slot:
+                if node.slot_node is None:
+                    node.slot_name = slot.group(1)
+                    node.slot_node = _Node()
+                elif node.slot_name != slot.group(1):
+                    raise ValueError(f"Conflicting slot names at '{word}' in intent '{intent.pattern}'.")
+                node = node.slot_node
+                continue
+            word = _normalize_word(word)
+            if not word:
+                continue
+            node = node.children.setdefault(word, _Node())
+        node.intent = intent
+        self.size += 1
+
+    def match(self, query):
+        """Return an IntentMatch if the whole query matches a known intent, else None."""
+        raw_words = query.split()
+        words = [_normalize_word(word) for word in raw_words]
+        return self._match(self._root, raw_words, words, 0, {})
+
+    def _match(self, node, raw_words, words, i, slots):
+        # Skip words that are nothing but punctuation
+        while i < len(words) and not words[i]:
+            i += 1
+        if i == len(words):
+            return IntentMatch(node.intent, dict(slots)) if node.intent else None
+
+        child = node.children.get(words[i])
+        if child is not None:
+            found = self._match(child, raw_words, words, i + 1, slots)
+            if found:
+                return found
+
+        if node.slot_node is not None:
+            # Shortest slot value that lets the rest of the pattern match
+            for end in range(i + 1, len(words) + 1):
+                slots[node.slot_name] = _unquote(" ".join(raw_words[i:end]))
+                found = self._match(node.slot_node, raw_words, words, end, slots)
+                if found:
+                    return found
+            slots.pop(node.slot_name, None)
+        return None
+
+
+def load_router(path=INTENTS_FILE):
+    """Load the intent router, or return None when local intents are disabled or unavailable."""
+    if not LOCAL_INTENTS or not os.path.exists(path):
+        return None
+    return IntentRouter.from_file(path)
@@ -0,0 +1,214 @@
+"""
+Client-side rate limiting and scheduling of LLM requests.
+
+Every completion call goes through one RequestScheduler:
+- token buckets sized in requests and tokens per minute keep us under the
+  shared API key's limits instead of running into 429s;
+- interactive requests are served before background (batch) ones;
+- rate-limit and transient errors are retried with jittered exponential
+  backoff, or after the server's retry-after delay when it sends one. A 429
+  pauses all requests, since they share the same key.
+
+Set a limit to 0 to disable that bucket.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 30))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 30))
+NOTIFY_WAIT_SECONDS = 1.0  # tell the user about waits longer than this
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {"APIConnectionError", "TransportError"}  # SDK and raw httpx network errors/timeouts
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 units per second up to a burst of one minute's worth."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _fill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount units are available (requests larger than the bucket wait for a full one)."""
+        self._fill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+def is_retryable(error) -> bool:
+    if getattr(error, "status_code", None) in _RETRYABLE_STATUS:
+        return True
+    return any(cls.__name__ in _RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def retry_after(error):
+    """The server's requested delay in seconds from retry-after(-ms) headers, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """Admits LLM calls in priority order within the rate limits and retries transient failures."""
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX):
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+        self._blocked_until = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.waited_seconds = 0.0
+
+    def _wait_time(self, tokens, now):
+        wait = self._blocked_until - now
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens is not None and tokens:
+            wait = max(wait, self._tokens.wait_time(tokens, now))
+        return wait
+
+    def acquire(self, tokens=0, priority=INTERACTIVE, notify=None):
+        """Block until this request may be sent; only the highest-priority waiter takes capacity."""
+        ticket = (priority, next(self._sequence))
+        start = time.monotonic()
+        notified = False
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = None  # not first in line: sleep until the head of the queue moves
+                    if self._waiting[0] == ticket:
+                        now = time.monotonic()
+                        wait = self._wait_time(tokens, now)
+                        if wait <= 0:
+                            if self._requests is not None:
+                                self._requests.take(1)
+                            if self._tokens is not None and tokens:
+                                self._tokens.take(tokens)
+                            break
+                        if notify is not None and not notified and wait > NOTIFY_WAIT_SECONDS:
+                            notify(wait)
+                            notified = True
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self.requests += 1
+            self.waited_seconds += waited
+        if waited > NOTIFY_WAIT_SECONDS:
+            logging.info(f"LLM request waited {waited:.2f}s for rate limits (priority={priority})")
+
+    def refund(self, tokens):
+        """Return reserved tokens that a request did not use."""
+        if self._tokens is None or tokens <= 0:
+            return
+        with self._cond:
+            self._tokens.give_back(tokens)
+            self._cond.notify_all()
+
+    def block_for(self, seconds):
+        """Hold back every request for the given time, e.g. after a 429."""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def _backoff(self, attempt):
+        # Equal jitter: at least half the exponential delay, so retries still spread out
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def submit(self, call, tokens=0, priority=INTERACTIVE, notify=None):
+        """
+        Run call() once the rate limits allow it, retrying rate-limit and
+        transient errors; other errors, and the last retryable one, are raised.
+        notify(seconds) is called before long waits so the user knows why.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority, notify)
+            try:
+                return call()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                status = getattr(e, "status_code", None)
+                logging.warning(f"LLM request failed ({status or type(e).__name__}), "
+                                f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                with self._cond:
+                    self.retries += 1
+                    if status == 429:
+                        self.rate_limited += 1
+                if notify is not None and delay > NOTIFY_WAIT_SECONDS:
+                    notify(delay)
+                if status == 429:
+                    self.block_for(delay)  # the whole key is over its limit, not just this request
+                else:
+                    time.sleep(delay)
+                attempt += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'waited_seconds': round(self.waited_seconds, 3),
+                'queued': len(self._waiting),
+            }
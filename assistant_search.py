@@ -0,0 +1,140 @@
+"""
+Inverted index over past prompts for fuzzy "did you mean" suggestions.
+
+Every distinct prompt is indexed once under its words and its character
+trigrams. A query collects candidates from the posting lists of its rarest
+words (falling back to trigrams for words never seen, i.e. typos), then ranks
+the best candidates by trigram Dice similarity, so lookups stay around a
+millisecond on large histories. The index is updated in place as commands
+are recorded.
+"""
+
+import re
+import threading
+from collections import Counter
+
+SUGGESTION_THRESHOLD = 0.45  # minimum Dice similarity between prompts
+POSTINGS_BUDGET = 2000  # posting entries scanned per query beyond the rarest list
+_CANDIDATES_PER_RESULT = 20
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+
+def trigrams(text: str) -> frozenset:
+    padded = f"  {normalize(text)} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TrigramIndex:
+    """Word and trigram index of distinct prompts and the latest command run for each."""
+
+    def __init__(self):
+        self._doc_ids = {}      # normalized prompt -> doc id
+        self._prompts = []
+        self._commands = []
+        self._successes = []
+        self._grams = []
+        self._postings = {}     # trigram -> list of doc ids
+        self._word_postings = {}  # word -> list of doc ids
+        self.last_history_id = 0
+        # Writers are serialized; searches read without locking because a doc is
+        # fully stored before any posting list or the prompt map refers to it
+        self._write_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._prompts)
+
+    def add(self, user_prompt, command, success):
+        """Index a recorded command; a repeated prompt just points at its newest command."""
+        with self._write_lock:
+            self._add(user_prompt, command, success)
+
+    def _add(self, user_prompt, command, success):
+        if not user_prompt or not command:
+            return
+        key = normalize(user_prompt)
+        doc_id = self._doc_ids.get(key)
+        if doc_id is not None:
+            # Keep a known-good command unless the new one worked too
+            if success or not self._successes[doc_id]:
+                self._commands[doc_id] = command
+                self._successes[doc_id] = success
+            return
+        doc_id = len(self._prompts)
+        grams = trigrams(key)
+        self._prompts.append(user_prompt)
+        self._commands.append(command)
+        self._successes.append(success)
+        self._grams.append(grams)
+        for gram in grams:
+            _post(self._postings, gram, doc_id)
+        for word in set(key.split()):
+            _post(self._word_postings, word, doc_id)
+        self._doc_ids[key] = doc_id
+
+    def refresh(self, store):
+        """
+        Pick up entries written to the store since the last refresh (e.g. by other
+        terminals). Returns immediately if another refresh is already running.
+
+        Only a refresh advances last_history_id: a local add can get a higher id
+        than a row another terminal wrote just before it, so the local entries
+        are read back here too (re-adding a prompt is harmless).
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            for history_id, user_prompt, command, success in store.prompts_since(self.last_history_id):
+                self.add(user_prompt, command, success)
+                self.last_history_id = history_id
+        finally:
+            self._refresh_lock.release()
+
+    def search(self, query, limit=5, threshold=SUGGESTION_THRESHOLD):
+        """Return up to `limit` (score, prompt, command, success) tuples, best first."""
+        query_grams = trigrams(query)
+        if not query_grams or not self._prompts:
+            return []
+
+        # Rare words are the most selective, so walk their posting lists first and
+        # stop once the budget is spent; unseen words contribute their rarest trigrams
+        lists = []
+        for word in set(normalize(query).split()):
+            postings = self._word_postings.get(word)
+            if postings is not None:
+                lists.append(postings)
+            else:
+                word_lists = sorted((self._postings[g] for g in trigrams(word) if g in self._postings), key=len)
+                lists.extend(word_lists[:2])
+        if not lists:
+            return []
+        lists.sort(key=len)
+
+        # Posting lists are in insertion order, so a capped list keeps the most recent prompts
+        counts = Counter(lists[0][-POSTINGS_BUDGET:])
+        scanned = 0
+        for postings in lists[1:]:
+            scanned += len(postings)
+            if scanned > POSTINGS_BUDGET:
+                break
+            counts.update(postings)
+
+        results = []
+        for doc_id, _ in counts.most_common(limit * _CANDIDATES_PER_RESULT):
+            grams = self._grams[doc_id]
+            score = 2 * len(query_grams & grams) / (len(query_grams) + len(grams))
+            if score >= threshold:
+                results.append((round(score, 3), self._prompts[doc_id], self._commands[doc_id], self._successes[doc_id]))
+        results.sort(key=lambda r: (r[0], r[3]), reverse=True)
+        return results[:limit]
+
+
+def _post(index, token, doc_id):
+    postings = index.get(token)
+    if postings is None:
+        index[token] = [doc_id]
+    else:
+        postings.append(doc_id)
@@ -0,0 +1,395 @@
+"""
+Persistent shell session.
+
+Instead of a new shell per command, one long-lived bash, zsh, sh or pwsh
+coprocess runs the session's commands: its startup is paid once, and 'cd',
+exports and shell variables carry over from one command to the next. Each
+command is written to the shell over a pipe, followed by a line that prints an
+end marker with the exit status and working directory on stdout and another
+marker on stderr; what the shell prints before the markers is the command's
+output. The markers go to copies of stdout/stderr the command does not see, and
+redirections a command makes with 'exec' are undone after it, so they cannot
+swallow the markers.
+
+The assistant follows the shell's working directory, so commands started
+outside the session (jobs, commands under rlimits) run there too; they do not
+see the session's shell variables or exports. If the shell exits, is killed at
+a limit or cannot be talked to, the next command starts a new one in the last
+working directory.
+"""
+
+import base64
+import itertools
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from assistant_exec import (KILL_GRACE_SECONDS, OUTPUT_MEMORY_CAP, READ_CHUNK_SIZE, BoundedCapture, RunningCommand,
+                            _foreground_terminal, _group_kwargs, _GroupKiller, _set_foreground)
+
+PERSISTENT_SHELL = os.getenv("PERSISTENT_SHELL", "1") == "1"
+SESSION_SHELL = os.getenv("SESSION_SHELL", os.getenv("SHELL", "/bin/sh"))
+SHELL_START_TIMEOUT = float(os.getenv("SHELL_START_TIMEOUT", 10))
+
+# Shells that speak the protocol, with the arguments that skip the user's rc files
+_POSIX_SHELLS = {
+    "bash": ["--noprofile", "--norc"],
+    "zsh": ["-f"],
+    "sh": [],
+    "dash": [],
+    "ksh": [],
+    "mksh": [],
+}
+_PWSH = {"pwsh", "powershell"}
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_POSIX_INIT = (
+    # fds 8 and 9 keep the original stdout/stderr for the markers
+    "exec 8>&1 9>&2\n"
+    # Ctrl-C stops the command, not the shell; children get the default action back
+    "trap : INT\n"
+)
+_PWSH_ARGS = ["-NoLogo", "-NoProfile", "-NonInteractive", "-Command", "-"]
+
+
+def shell_kind(path):
+    """'posix' or 'pwsh' for a shell the session can drive, else None."""
+    name = os.path.basename(path).lower()
+    if name.endswith(".exe"):
+        name = name[:-4]
+    if name in _POSIX_SHELLS:
+        return "posix"
+    if name in _PWSH:
+        return "pwsh"
+    return None
+
+
+def _posix_wrap(command, marker, stdin_redirect):
+    # 'command' keeps a syntax error in eval from exiting sh; redirections on
+    # eval itself are undone after it, also those a command makes with 'exec'
+    return (f"command eval {shlex.quote(command)} >&8 2>&9 8>&- 9>&-{stdin_redirect}\n"
+            f"command printf '\\n%s %s %s\\n' '{marker}' \"$?\" \"$PWD\" >&8; "
+            f"command printf '\\n%s\\n' '{marker}' >&9\n")
+
+
+def _pwsh_wrap(command, marker):
+    # Encoded so that quotes and newlines in the command cannot break the line
+    encoded = base64.b64encode(command.encode()).decode()
+    return (f"$global:LASTEXITCODE = 0; $__ok = $true; "
+            f"try {{ Invoke-Expression ([Text.Encoding]::UTF8.GetString([Convert]::FromBase64String('{encoded}'))); "
+            f"$__ok = $? }} catch {{ $__ok = $false; [Console]::Error.WriteLine($_) }}; "
+            f"$__rc = if ($LASTEXITCODE) {{ $LASTEXITCODE }} elseif ($__ok) {{ 0 }} else {{ 1 }}; "
+            f"[Console]::Out.Write(\"`n{marker} $__rc $($PWD.ProviderPath)`n\"); [Console]::Out.Flush(); "
+            f"[Console]::Error.Write(\"`n{marker}`n\"); [Console]::Error.Flush()\n")
+
+
+def _partial_marker(data, marker):
+    """Length of the longest end of data that could be the start of marker (which starts with a newline)."""
+    i = data.find(b"\n", max(0, len(data) - len(marker) + 1))
+    while i >= 0:
+        if marker.startswith(data[i:]):
+            return len(data) - i
+        i = data.find(b"\n", i + 1)
+    return 0
+
+
+class ShellRun(RunningCommand):
+    """
+    One command running in a ShellProcess; the same interface as
+    RunningCommand, so it can be detached into a job. Killing it kills the
+    shell, which the session then replaces.
+    """
+
+    def __init__(self, shell, command, limits=None, echo=True, memory_cap=OUTPUT_MEMORY_CAP):
+        self.command = command
+        self.limits = limits
+        self.shell = shell
+        self.process = shell.process
+        self.spawn_mode = "session"
+        self.terminal = _foreground_terminal() if echo and shell.terminal is not None else None
+        self.reads_terminal = self.terminal is not None
+        self.started = time.monotonic()
+        self.deadline = self.started + limits.timeout if limits is not None and limits.timeout else None
+        self.echo = echo
+        self.out = BoundedCapture(memory_cap)
+        self.err = BoundedCapture(memory_cap)
+        self._output_limit = limits.output_bytes if limits is not None else 0
+        self._lock = threading.Lock()
+        self._killer = shell.killer
+        self._result = None
+        self._readers = []  # the shell's readers outlive the command
+        self.feeds = (self._feeder(self.out, sys.stdout), self._feeder(self.err, sys.stderr))
+        self.exit_code = None
+        self.pwd = None
+        self.background = False  # detached once; its 'cd' no longer moves the session
+        self.done = threading.Event()
+        self.cpu_start = shell.cpu_seconds()
+        self.cpu_seconds = None
+        if echo:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+    def _wait_exit(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise subprocess.TimeoutExpired(self.command, timeout)
+        return self.exit_code
+
+    def _cpu_seconds(self):
+        return self.cpu_seconds
+
+    def detach(self):
+        self.background = True
+        self.shell.retire()
+        super().detach()
+
+    def result(self):
+        if self._result is None:
+            super().result()
+            if self.shell.retired:
+                self.shell.close()
+            elif self.pwd and not self.background:
+                try:
+                    os.chdir(self.pwd)
+                except OSError as e:
+                    logging.warning(f"Could not follow the session shell to {self.pwd}: {e}")
+        return self._result
+
+
+class ShellProcess:
+    """A shell coprocess and the reader threads that split its output at the end markers."""
+
+    def __init__(self, path, kind, terminal=None):
+        self.path = path
+        self.kind = kind
+        self.terminal = terminal
+        self.token = uuid.uuid4().hex
+        self._seq = itertools.count()
+        self._run = None
+        self._markers = (b"", b"")
+        self._lock = threading.Lock()
+        self.retired = False  # handed over to a job; closed once its command ends
+        if kind == "pwsh":
+            self.process = subprocess.Popen([path, *_PWSH_ARGS], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE, **_group_kwargs(None))
+            self._input = self.process.stdin
+        else:
+            # Commands come in on a pipe of their own, so the shell's stdin stays the terminal
+            read_fd, write_fd = os.pipe()
+            try:
+                args = _POSIX_SHELLS.get(os.path.basename(path).lower(), [])
+                self.process = subprocess.Popen(
+                    [path, *args, f"/dev/fd/{read_fd}"], pass_fds=(read_fd,),
+                    stdin=None if terminal is not None else subprocess.DEVNULL, stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE, **_group_kwargs(None))
+            except BaseException:
+                os.close(write_fd)
+                raise
+            finally:
+                os.close(read_fd)
+            self._input = os.fdopen(write_fd, "wb")
+            self._input.write(_POSIX_INIT.encode())
+        try:
+            self._stat_fd = os.open(f"/proc/{self.process.pid}/stat", os.O_RDONLY)
+        except OSError:
+            self._stat_fd = None  # no /proc: commands in the session report no CPU time
+        self.killer = _GroupKiller(self.process)
+        self._readers = [threading.Thread(target=self._read, args=(index, pipe), daemon=True)
+                         for index, pipe in enumerate((self.process.stdout, self.process.stderr))]
+        for reader in self._readers:
+            reader.start()
+
+    def cpu_seconds(self):
+        """
+        CPU time of the shell plus the children it has waited for (utime, stime,
+        cutime and cstime from /proc, in clock ticks), or None. A command in the
+        session is the shell's child or a builtin, so our own rusage never sees it.
+        """
+        with self._lock:  # close() may run in another thread
+            if self._stat_fd is None:
+                return None
+            try:
+                stat = os.pread(self._stat_fd, 1024, 0)
+            except OSError:
+                return None  # the shell is gone
+        # pid (comm) state ppid ... utime stime cutime cstime ...
+        fields = stat[stat.rfind(b")") + 2:].split()
+        return sum(int(field) for field in fields[11:15]) / _CLOCK_TICKS
+
+    @property
+    def alive(self):
+        return self.process.poll() is None and self.killer.reason is None
+
+    def start(self, command, limits=None, echo=True, memory_cap=OUTPUT_MEMORY_CAP):
+        """Send a command to the shell; returns its ShellRun. Raises OSError if the shell is gone."""
+        run = ShellRun(self, command, limits, echo, memory_cap)
+        marker = f"__ASSISTANT_{self.token}_{next(self._seq)}__"
+        if self.kind == "pwsh":
+            script = _pwsh_wrap(command, marker)
+        else:
+            script = _posix_wrap(command, marker, "" if run.terminal is not None else " </dev/null")
+        with self._lock:
+            self._run = run
+            self._markers = (b"\n" + marker.encode(),) * 2
+        if run.terminal is not None:
+            _set_foreground(run.terminal, self.process.pid)
+        try:
+            self._input.write(script.encode())
+            self._input.flush()
+        except (OSError, ValueError):
+            self._finish(run, self.process.poll())
+            run._release_terminal()
+            raise OSError(f"Session shell {self.path} is not running")
+        return run
+
+    def _read(self, index, pipe):
+        read = getattr(pipe, "read1", pipe.read)
+        pending = b""
+        while True:
+            chunk = read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            pending = self._split(index, pending + chunk)
+        pipe.close()
+        # EOF: the shell is gone; a command it was running ends with the shell's exit status
+        with self._lock:
+            run = self._run
+        if run is not None:
+            self._finish(run, self.process.wait())
+
+    def _split(self, index, data):
+        """Feed the command's part of data to the current run; returns what to keep for later."""
+        with self._lock:
+            run, marker = self._run, self._markers[index]
+        if run is None or marker is None:
+            # Between commands: output of something the shell left in the background. It is
+            # not the next command's, and keeping it would let it grow without bound
+            logging.debug(f"Dropped {len(data)} bytes the session shell printed between commands")
+            return b""
+        pos = data.find(marker)
+        if pos < 0:
+            keep = _partial_marker(data, marker)
+            if len(data) > keep:
+                run.feeds[index](data[:len(data) - keep])
+            return data[len(data) - keep:]
+        if pos:
+            run.feeds[index](data[:pos])
+        end = data.find(b"\n", pos + len(marker))
+        if end < 0:
+            return data[pos:]  # the rest of the marker line is still coming
+        trailer = data[pos + len(marker):end].decode(errors="replace").strip()
+        with self._lock:
+            self._markers = self._markers[:index] + (None,) + self._markers[index + 1:]
+            finished = self._markers == (None, None)
+        if index == 0:
+            status, _, pwd = trailer.partition(" ")
+            run.exit_code = int(status) if status.lstrip("-").isdigit() else 1
+            run.pwd = pwd or None
+        if finished:
+            self._finish(run, run.exit_code)
+        return data[end + 1:]
+
+    def _finish(self, run, exit_code):
+        with self._lock:
+            if run.done.is_set():
+                return
+            if self._run is run:
+                self._run = None
+            if run.exit_code is None:
+                run.exit_code = exit_code
+        # The shell has waited for the command by the time it prints the marker
+        cpu_end = self.cpu_seconds() if run.cpu_start is not None else None
+        if cpu_end is not None:
+            run.cpu_seconds = round(cpu_end - run.cpu_start, 6)
+        run.done.set()
+
+    def retire(self):
+        """Leave the shell to its running command; the session starts a new one."""
+        self.retired = True
+
+    def close(self):
+        """Close the command pipe so the shell exits; kill it if it does not."""
+        try:
+            self._input.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(KILL_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            self.killer.kill("closed")
+            self.process.wait()
+        with self._lock:
+            if self._stat_fd is not None:
+                os.close(self._stat_fd)
+                self._stat_fd = None
+
+
+class ShellSession:
+    """The session's current shell, started on first use and replaced when it dies or is retired."""
+
+    def __init__(self, path=SESSION_SHELL):
+        if shell_kind(path) is None:
+            logging.info(f"Shell {path} cannot be driven as a session shell, using /bin/sh")
+            path = "/bin/sh"
+        self.path = path
+        self.kind = shell_kind(path)
+        self.shell = None
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._warming = None
+
+    def _current(self):
+        with self._lock:
+            shell = self.shell
+            if shell is not None and shell.alive and not shell.retired:
+                return shell
+            if shell is not None and not shell.retired:
+                self.restarts += 1
+                code = shell.process.poll()
+                reason = shell.killer.reason
+                note = f"killed ({reason})" if reason else f"exited with code {code}"
+                print(f"[Session shell {note}; starting a new one in {os.getcwd()}, "
+                      f"shell variables and exports are lost.]")
+                logging.warning(f"Session shell {shell.process.pid} {note}; restarting")
+                shell.close()
+            started = time.perf_counter()
+            self.shell = ShellProcess(self.path, self.kind, _foreground_terminal())
+            logging.info(f"Started session shell {self.path} (pid {self.shell.process.pid}) "
+                         f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+            return self.shell
+
+    def _warm_up(self):
+        try:
+            run = self._current().start(":", echo=False)
+            if run.wait(SHELL_START_TIMEOUT) is None:
+                run.kill("timeout")
+            run.result()
+        except OSError as e:
+            logging.warning(f"Starting session shell {self.path} failed: {e}")
+
+    def prewarm(self):
+        """Start the shell in the background, so the first command does not wait for its startup."""
+        self._warming = threading.Thread(target=self._warm_up, name="shell-prewarm", daemon=True)
+        self._warming.start()
+
+    def start(self, command, limits=None, echo=True, memory_cap=OUTPUT_MEMORY_CAP):
+        """Run a command in the session shell, starting or replacing the shell first if needed."""
+        if self._warming is not None:
+            self._warming.join()
+            self._warming = None
+        try:
+            return self._current().start(command, limits, echo, memory_cap)
+        except OSError:
+            # It died between the check and the write
+            return self._current().start(command, limits, echo, memory_cap)
+
+    def close(self):
+        if self._warming is not None:
+            self._warming.join()
+        with self._lock:
+            shell, self.shell = self.shell, None
+        if shell is not None and not shell.retired:
+            shell.close()
@@ -0,0 +1,211 @@
+"""
+Structured tracing of REPL turns.
+
+Each query is traced as a tree of spans (query -> llm.request, exec, retry ->
+...). Each span carries its timing plus attributes such as token counts,
+model, exit code, output bytes and CPU time. When a root span ends, its whole
+tree is:
+- appended to TRACE_FILE as JSON lines, one per span;
+- folded into per-span latency histograms and counters, which are rewritten
+  atomically to PROMETHEUS_TEXTFILE for a node exporter's textfile collector.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACING_ENABLED = os.getenv("TRACING", "1") == "1"
+TRACE_FILE = os.getenv("TRACE_FILE", "assistant_traces.jsonl")
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "assistant.prom")
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_current_span = contextvars.ContextVar("assistant_span", default=None)
+
+
+class Span:
+    """One timed operation; children are attached when they end."""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'duration', 'status',
+                 'attributes', 'children', '_started')
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.duration = None
+        self.status = "ok"
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        """Mark the span failed by an error that was handled inside it."""
+        self.status = "error"
+        self.attributes['error'] = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def as_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    """Prometheus histograms and counters built from finished spans."""
+
+    def __init__(self):
+        self.histograms = {}  # span name -> [bucket counts..., +Inf count, sum]
+        self.counters = {}  # (metric, labels) -> value
+
+    def _count(self, metric, value=1, **labels):
+        key = (metric, _labels(**labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, span):
+        histogram = self.histograms.get(span.name)
+        if histogram is None:
+            histogram = self.histograms[span.name] = [0] * (len(_BUCKETS) + 2)
+        for i, bound in enumerate(_BUCKETS):
+            if span.duration <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += span.duration
+        if span.status != "ok":
+            self._count("assistant_span_errors_total", span=span.name)
+
+        attributes = span.attributes
+        if 'exit_code' in attributes:
+            self._count("assistant_commands_total", result="success" if attributes['exit_code'] == 0 else "failure")
+            self._count("assistant_command_output_bytes_total",
+                        attributes.get('stdout_bytes', 0) + attributes.get('stderr_bytes', 0))
+            if attributes.get('killed'):
+                self._count("assistant_commands_killed_total", reason=attributes['killed'])
+            if attributes.get('cpu_seconds') is not None:
+                self._count("assistant_command_cpu_seconds_total", attributes['cpu_seconds'])
+        if 'verdict' in attributes:
+            self._count("assistant_policy_verdicts_total", verdict=attributes['verdict'])
+        if 'prompt_tokens' in attributes:
+            model = attributes.get('model', "unknown")
+            self._count("assistant_llm_tokens_total", attributes['prompt_tokens'], model=model, kind="prompt")
+            self._count("assistant_llm_tokens_total", attributes.get('completion_tokens', 0), model=model, kind="completion")
+
+    def render(self):
+        lines = ["# HELP assistant_span_duration_seconds Duration of traced assistant operations.",
+                 "# TYPE assistant_span_duration_seconds histogram"]
+        for name, histogram in sorted(self.histograms.items()):
+            for bound, count in zip(_BUCKETS, histogram):
+                lines.append(f"assistant_span_duration_seconds_bucket{_labels(span=name, le=bound)} {count}")
+            lines.append(f"assistant_span_duration_seconds_bucket{_labels(span=name, le='+Inf')} {histogram[-2]}")
+            lines.append(f"assistant_span_duration_seconds_count{_labels(span=name)} {histogram[-2]}")
+            lines.append(f"assistant_span_duration_seconds_sum{_labels(span=name)} {histogram[-1]:.6f}")
+        typed = set()
+        for (metric, labels), value in sorted(self.counters.items()):
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{labels} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """Creates nested spans and exports finished traces."""
+
+    def __init__(self, trace_file=TRACE_FILE, metrics_file=PROMETHEUS_TEXTFILE, enabled=TRACING_ENABLED):
+        # Absolute, as the REPL follows the session shell's 'cd'
+        self.trace_file = os.path.abspath(trace_file) if trace_file else trace_file
+        self.metrics_file = os.path.abspath(metrics_file) if metrics_file else metrics_file
+        self.enabled = enabled
+        self.metrics = Metrics()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the enclosed block as a child of the current span (or as a new trace)."""
+        if not self.enabled:
+            yield _NOOP_SPAN
+            return
+        parent = _current_span.get()
+        span = Span(name, parent, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attributes.setdefault('error', f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+            if parent is not None:
+                parent.children.append(span)
+            else:
+                self._export(span)
+
+    def annotate(self, **attributes):
+        """Add attributes to the current span, if any."""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def _export(self, root):
+        spans = list(root.walk())
+        try:
+            with self._lock:
+                for span in spans:
+                    self.metrics.observe(span)
+                if self.trace_file:
+                    with open(self.trace_file, "a") as f:
+                        f.write("".join(json.dumps(span.as_dict()) + "\n" for span in spans))
+                if self.metrics_file:
+                    # Write-then-rename so the collector never reads a half-written file
+                    tmp_path = f"{self.metrics_file}.{os.getpid()}.tmp"
+                    with open(tmp_path, "w") as f:
+                        f.write(self.metrics.render())
+                    os.replace(tmp_path, self.metrics_file)
+        except OSError as e:
+            logging.warning(f"Exporting trace {root.trace_id} failed: {e}")
+
+
+tracer = Tracer()
@@ -20,6 +20,8 @@ import os
 import subprocess
 import shlex
 
+from assistant_router import INTENTS_FILE, MACOS_INTENTS_FILE, IntentRouter
+
 def run_command(command: str):
     """Execute a command and return its output or an error message."""
     try:
@@ -32,49 +34,16 @@ def run_command(command: str):
     except Exception as e:
         return f"Error executing command: {str(e)}"
 
+intent_router = IntentRouter.from_file(INTENTS_FILE, MACOS_INTENTS_FILE)
+
 def handle_query(query: str):
     """Process user queries and execute appropriate commands."""
-    responses = {
-        "how many notes do I have saved": lambda: run_command("find ~/ -iname 'note*' | wc -l"),
-        "are there any movies left in the unedited folder": lambda: run_command("ls ~/Movies/Unedited | grep mov"),
-        "can you tell me a fortune cookie message": lambda: run_command("fortune") if check_program_installed("fortune") else "Please install the 'fortune' command to receive fortune cookie messages.",
-        "use cowsay with": lambda text: run_command(f"cowsay '{text}'") if check_program_installed("cowsay") else "Please install 'cowsay' to use this feature.",
-        "what is my python version": lambda: run_command("python --version"),
-        "are there any more python versions installed": lambda: run_command("python3 -V && python -V"),
-        "is there a process running, that is suspicious": lambda process: run_command(f"pgrep -a {process}") if process else "Please provide a process name.",
-        "any irregularities within my running processes": lambda: run_command("top -b -n1 | head -n20"),
-        "i am looking for a picture but I can't find it, the filename should be something like": lambda filename: run_command(f"find ~/ -name '{filename}*'") if filename else "Please provide a partial filename.",
-        "try": lambda search: run_command(f"open -a 'Safari' https://www.google.com/images?q={search.replace(' ', '+')}"),
-        "who told you to speak": lambda: run_command("say 'Hello, I am an AI assistant. How can I help you?'")
-    }
-
-    # Parse the query
-    query_lower = query.lower()
-    response = "Sorry, I didn't understand that."
-    
-    if "use cowsay with" in query_lower:
-        message = query.split("use cowsay with", 1)[1].strip()
-        response = responses["use cowsay with"](message)
-    elif "is there a process running, that is suspicious" in query_lower:
-        process_name = query.split("is there a process running, that is suspicious", 1)[1].strip()
-        response = responses["is there a process running, that is suspicious"](process_name)
-    elif "i am looking for a picture but i can't find it, the filename should be something like" in query_lower:
-        filename = query.split("filename should be something like", 1)[1].strip()
-        response = responses["i am looking for a picture but i can't find it, the filename should be something like"](filename)
-    elif "try" in query_lower:
-        search_term = query.split("try", 1)[1].strip()
-        response = responses["try"](search_term)
-    else:
-        for key, func in responses.items():
-            if query_lower.startswith(key):
-                response = func()
-                break
-
-    return response
-
-def check_program_installed(program: str) -> bool:
-    """Check if a particular program is installed and available."""
-    return subprocess.call(['which', program], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+    match = intent_router.match(query)
+    if match is None:
+        return "Sorry, I didn't understand that."
+    if match.message:
+        return match.message
+    return run_command(match.command)
 
 # Example conversation
 queries = [
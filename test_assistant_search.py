@@ -0,0 +1,47 @@
+import pytest
+
+from assistant_history import HistoryStore
+from assistant_search import TrigramIndex
+
+
+def test_refresh_indexes_row_written_by_another_terminal_before_a_local_add(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    ours, theirs = HistoryStore(path), HistoryStore(path)
+    index = TrigramIndex()
+    try:
+        index.add("list my files", "ls", True)
+        ours.append("list my files", "ls", True)
+        index.refresh(ours)
+
+        # Another terminal records N+1, then this one records and indexes N+2
+        theirs.append("show disk usage", "df -h", True)
+        index.add("count lines in notes", "wc -l notes.txt", True)
+        ours.append("count lines in notes", "wc -l notes.txt", True)
+
+        index.refresh(ours)
+        assert [r[2] for r in index.search("show disk usage")][:1] == ["df -h"]
+        assert index.last_history_id == 3
+    finally:
+        ours.close()
+        theirs.close()
+
+
+def test_retrieval_refresh_indexes_row_written_by_another_terminal_before_a_local_add(tmp_path):
+    pytest.importorskip("numpy")
+    from assistant_retrieval import RetrievalIndex
+
+    path = str(tmp_path / "history.sqlite3")
+    ours, theirs = HistoryStore(path), HistoryStore(path)
+    index = RetrievalIndex()
+    try:
+        index.refresh(ours)
+        theirs.append("show disk usage", "df -h", True)
+        index.add("count lines in notes", "wc -l notes.txt", True)
+        ours.append("count lines in notes", "wc -l notes.txt", True)
+
+        index.refresh(ours)
+        assert [r[2] for r in index.search("show disk usage")][:1] == ["df -h"]
+        assert index.last_history_id == 2
+    finally:
+        ours.close()
+        theirs.close()